@@ -0,0 +1,19 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
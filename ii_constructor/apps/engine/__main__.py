@@ -0,0 +1,210 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import asyncio
+import logging
+import os
+
+from host import EngineHost, per_process
+from iiconstructor_core.domain.porst import ScenarioInterface
+from iiconstructor_core.domain.primitives import ScenarioID
+from server import MAX_BODY_SIZE, READ_TIMEOUT, EngineServer, EventHandler
+
+
+def make_host(args: argparse.Namespace) -> EngineHost:
+    from iiconstructor_inmemory.compiled import compile_scenario
+    from iiconstructor_inmemory.snapshot import load_snapshot
+    from mysqlrepo import HostingMySQL
+
+    # пул подключений к БД свой у каждого процесса
+    def connect() -> HostingMySQL:
+        hosting = HostingMySQL()
+        hosting.connect(
+            os.environ.get("IP"),
+            int(os.environ.get("PORT")),
+            os.environ.get("USER"),
+            os.environ.get("PASSWORD"),
+            max_size=args.db_pool_size,
+        )
+        return hosting
+
+    get_hosting = per_process(connect)
+
+    def snapshot_path(id: ScenarioID) -> str | None:
+        if args.snapshots is None:
+            return None
+
+        path = os.path.join(args.snapshots, f"{id.value}.iisnap")
+        return path if os.path.exists(path) else None
+
+    def load(id: ScenarioID) -> ScenarioInterface:
+        path = snapshot_path(id)
+        if path is not None:
+            return load_snapshot(path)
+
+        return compile_scenario(get_hosting().get_scenario(id))
+
+    def version(id: ScenarioID) -> int | None:
+        # версия снимка - время изменения файла
+        path = snapshot_path(id)
+        if path is not None:
+            return os.stat(path).st_mtime_ns
+
+        return get_hosting().version(id)
+
+    max_memory = None
+    if args.max_memory is not None:
+        max_memory = args.max_memory * 1024 * 1024
+
+    return EngineHost(load, args.max_scenarios, max_memory, version)
+
+
+def serve(args: argparse.Namespace):
+    handler: EventHandler
+    stats = None
+
+    if args.multi:
+        host = make_host(args)
+        for id in args.preload:
+            host.get(ScenarioID(id))
+
+        handler = host.handle
+        stats = host.stats
+
+    else:
+        # сценарий загружается при импорте (параметры - из переменных окружения)
+        import index
+
+        host = index.host
+
+        def handler(path: str, event: dict) -> dict:
+            return index.handler(event, None)
+
+    def watch():
+        if args.reload_interval is not None:
+            host.watch(args.reload_interval)
+
+    executor = None
+    if args.workers > 0:
+        import workers
+
+        # индексы предзагруженных сценариев строятся до fork
+        # и разделяются рабочими процессами
+        host.warm_up()
+
+        # поток проверки изменений запускается в рабочих процессах после
+        # fork: унаследованные потоком блокировки и подключения к БД
+        # оказались бы общими для всех процессов
+        executor = workers.start_workers(handler, args.workers, watch)
+        handler = workers.handle
+        # статистика рабочих процессов не собирается
+        stats = None
+    else:
+        watch()
+
+    server = EngineServer(
+        handler,
+        executor,
+        stats,
+        args.max_body_size,
+        args.read_timeout,
+    )
+    asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Движок воспроизведения сценариев",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser(
+        "serve",
+        help="запустить HTTP-сервер для обработки событий платформы",
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument(
+        "--multi",
+        action="store_true",
+        help="обслуживать несколько сценариев (id сценария - в пути запроса)",
+    )
+    serve_parser.add_argument(
+        "--max-scenarios",
+        type=int,
+        default=None,
+        help="наибольшее число сценариев в памяти (для --multi)",
+    )
+    serve_parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=None,
+        help="наибольший объём сценариев в памяти, МБ (для --multi)",
+    )
+    serve_parser.add_argument(
+        "--preload",
+        type=int,
+        nargs="*",
+        default=[],
+        help="id сценариев для загрузки при старте (для --multi)",
+    )
+    serve_parser.add_argument(
+        "--snapshots",
+        default=None,
+        help="каталог снимков сценариев <id>.iisnap (для --multi)",
+    )
+    serve_parser.add_argument(
+        "--db-pool-size",
+        type=int,
+        default=8,
+        help="наибольшее число подключений к БД в процессе (для --multi)",
+    )
+    serve_parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=None,
+        help="период проверки изменений сценариев, с (по умолчанию не проверяются)",
+    )
+    serve_parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="число рабочих процессов (0 - обработка в потоках текущего процесса)",
+    )
+    serve_parser.add_argument(
+        "--max-body-size",
+        type=int,
+        default=MAX_BODY_SIZE,
+        help="наибольший размер тела запроса, байт (больше - ответ 413)",
+    )
+    serve_parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=READ_TIMEOUT,
+        help="время ожидания данных от клиента, с (потом соединение закрывается)",
+    )
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args()
+    args.func(args)
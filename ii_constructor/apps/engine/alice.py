@@ -0,0 +1,77 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+from iiconstructor_core.domain import Engine
+from iiconstructor_core.domain.exceptions import NotExists
+from iiconstructor_core.domain.primitives import (
+    Request,
+    Response,
+    StateID,
+)
+
+
+def process(engine: Engine, event: dict) -> dict:
+    """Обработать событие платформы (формат навыков Алисы) движком engine"""
+    if (
+        "request" in event
+        and "original_utterance" in event["request"]
+        and event["request"]["original_utterance"] != ""
+        and event["request"]["original_utterance"] == "ping"
+    ):
+        return {
+            "version": 1,
+            "session": 1,
+            "response": {"text": "pong", "end_session": True},
+        }
+
+    session_store = event["state"]["session"]
+
+    resp = Response()
+
+    if event["session"]["new"]:
+        cur_state = engine.start_state()
+        resp.text = cur_state.attributes.name.value
+
+        session_store = {"state": cur_state.id().value}
+
+    else:
+        # состояние сессии хранится на стороне платформы,
+        # обработчик не держит изменяемого состояния между запросами
+        cur_state_id = StateID(event["state"]["session"]["state"])
+
+        req = Request()
+        req.text = event["request"]["command"]
+        try:
+            new_state_id, resp = engine.step(cur_state_id, req)
+        except NotExists:
+            # состояния нет в обновлённом сценарии: сессия начинается заново
+            cur_state = engine.start_state()
+            resp.text = cur_state.attributes.name.value
+            new_state_id = cur_state.id()
+
+        session_store["state"] = new_state_id.value
+
+    return {
+        "version": event["version"],
+        "session": event["session"],
+        "session_state": session_store,
+        "response": {"text": resp.text, "end_session": False},
+    }
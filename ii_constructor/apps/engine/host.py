@@ -0,0 +1,401 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+from types import FunctionType, ModuleType
+from typing import TypeVar
+
+from alice import process
+from iiconstructor_core.domain import Engine
+from iiconstructor_core.domain.porst import ScenarioInterface
+from iiconstructor_core.domain.primitives import ScenarioID, StateName
+from iiconstructor_levenshtain import LevenshtainClassificator, Normalizer
+from server import RouteNotFound
+
+logger = logging.getLogger(__name__)
+
+ScenarioLoader = Callable[[ScenarioID], ScenarioInterface]
+""" загрузчик сценария по идентификатору (например, компиляция из БД) """
+
+ScenarioVersion = Callable[[ScenarioID], int | None]
+""" текущая версия сценария (дешёвый запрос, например версия проекта в БД) """
+
+T = TypeVar("T")
+
+
+def per_process(factory: Callable[[], T]) -> Callable[[], T]:
+    """
+    Получение объекта, который создаётся заново в каждом процессе.
+    Подключения к БД нельзя наследовать при fork, поэтому рабочий
+    процесс при первом обращении открывает свои
+    """
+    lock = threading.Lock()
+    created: dict[int, T] = {}
+
+    def get() -> T:
+        with lock:
+            obj = created.get(os.getpid())
+            if obj is None:
+                created.clear()
+                obj = factory()
+                created[os.getpid()] = obj
+
+            return obj
+
+    return get
+
+
+def make_normalizer() -> Normalizer:
+    """
+    Нормализация запросов и синонимов. Стоп-слова (по одному в строке)
+    читаются из файла, указанного в переменной окружения STOP_WORDS
+    """
+    path = os.environ.get("STOP_WORDS")
+    if path is None:
+        return Normalizer()
+
+    # стоп-слова приводятся к тому же виду, что и текст
+    normalize = Normalizer()
+    with open(path, encoding="utf-8") as file:
+        words = frozenset(normalize(line) for line in file if line.strip())
+
+    return Normalizer(stop_words=words)
+
+
+def footprint(*objects: object) -> int:
+    """Оценка объёма памяти (в байтах), занимаемого графом объектов"""
+    seen = set[int]()
+    pending = list(objects)
+    size = 0
+
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(
+            obj,
+            type | ModuleType | FunctionType,
+        ):
+            continue
+
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+
+    return size
+
+
+@dataclass
+class LoadedScenario:
+    """Загруженный в память сценарий с движком и статистикой загрузки"""
+
+    id: ScenarioID
+    scenario: ScenarioInterface
+    engine: Engine
+    load_time: float
+    """ время загрузки, с """
+    memory: int | None
+    """
+    оценка занимаемой памяти после построения индекса, байт
+    (None - не оценивается: ограничение памяти не задано)
+    """
+    version: int | None = None
+    """ версия сценария, из которой он загружен """
+    classificator: LevenshtainClassificator | None = None
+
+    def current_memory(self) -> int | None:
+        """Оценка памяти с учётом накопленных запомненных результатов"""
+        if self.memory is None or self.classificator is None:
+            return self.memory
+
+        return self.memory + self.classificator.memo_memory()
+
+
+class EngineHost:
+    """
+    Хост движков для нескольких сценариев.
+    Сценарий загружается при первом обращении к нему и остаётся в памяти,
+    пока укладывается в ограничения по количеству и объёму. При превышении
+    ограничений выгружаются сценарии, к которым дольше всего не обращались.
+    Изменённые сценарии перезагружаются в фоне (watch) и подменяют
+    загруженные целиком: начатые запросы завершаются на прежней версии,
+    следующие обрабатываются новой.
+    """
+
+    __load: ScenarioLoader
+    __version: ScenarioVersion | None
+    __normalizer: Normalizer
+    __max_count: int | None
+    __max_memory: int | None
+
+    __loaded: "OrderedDict[ScenarioID, LoadedScenario]"
+    """ загруженные сценарии в порядке обращения (последний - самый свежий) """
+
+    __lock: threading.Lock
+    __loading: dict[ScenarioID, threading.Lock]
+    """ блокировки загрузки, чтобы один сценарий не загружался дважды """
+
+    __watching: int | None
+    """ pid процесса, в котором запущена фоновая проверка изменений """
+
+    def __init__(
+        self,
+        load: ScenarioLoader,
+        max_count: int | None = None,
+        max_memory: int | None = None,
+        version: ScenarioVersion | None = None,
+    ) -> None:
+        """
+        @load - загрузчик сценария
+        @max_count - наибольшее число сценариев в памяти (None - без ограничения)
+        @max_memory - наибольший суммарный объём сценариев в памяти, байт (None - без ограничения)
+        @version - получение текущей версии сценария (None - перезагрузка не нужна)
+        """
+        self.__load = load
+        self.__version = version
+        self.__normalizer = make_normalizer()
+        self.__max_count = max_count
+        self.__max_memory = max_memory
+
+        self.__loaded = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__loading = {}
+        self.__watching = None
+
+    def get(self, id: ScenarioID) -> LoadedScenario:
+        """Получить сценарий, загрузив его при необходимости"""
+        with self.__lock:
+            if id in self.__loaded:
+                self.__loaded.move_to_end(id)
+                return self.__loaded[id]
+
+            load_lock = self.__loading.setdefault(id, threading.Lock())
+
+        with load_lock:
+            with self.__lock:
+                if id in self.__loaded:
+                    self.__loaded.move_to_end(id)
+                    return self.__loaded[id]
+
+            try:
+                loaded = self.__make(id)
+
+                with self.__lock:
+                    self.__loaded[id] = loaded
+                    self.__evict()
+
+            finally:
+                # блокировка не остаётся и после неудачной загрузки
+                with self.__lock:
+                    if self.__loading.get(id) is load_lock:
+                        del self.__loading[id]
+
+        return loaded
+
+    def __make(self, id: ScenarioID) -> LoadedScenario:
+        began = time.perf_counter()
+
+        # версия читается до загрузки: изменение во время загрузки
+        # будет замечено при следующей проверке
+        version = None
+        if self.__version is not None:
+            version = self.__version(id)
+
+        scenario = self.__load(id)
+        start_state = scenario.get_states_by_name(StateName("Старт"))[0]
+        classificator = LevenshtainClassificator(
+            scenario,
+            normalizer=self.__normalizer,
+        )
+        engine = Engine(classificator, start_state)
+
+        # без ограничения памяти индекс строится при первых запросах,
+        # а обход графа объектов для оценки не нужен
+        memory = None
+        if self.__max_memory is not None:
+            # индекс строится заранее, чтобы войти в оценку памяти
+            classificator.warm_up()
+            memory = footprint(scenario, engine)
+
+        load_time = time.perf_counter() - began
+        logger.info(
+            "Сценарий %s загружен за %.3f с (%s байт)",
+            id.value,
+            load_time,
+            "-" if memory is None else memory,
+        )
+
+        return LoadedScenario(
+            id,
+            scenario,
+            engine,
+            load_time,
+            memory,
+            version,
+            classificator,
+        )
+
+    def __evict(self):
+        """выгрузить давно не используемые сценарии сверх ограничений"""
+        total_memory = 0
+        if self.__max_memory is not None:
+            total_memory = sum(
+                item.current_memory() for item in self.__loaded.values()
+            )
+
+        while len(self.__loaded) > 1 and (
+            (
+                self.__max_count is not None
+                and len(self.__loaded) > self.__max_count
+            )
+            or (
+                self.__max_memory is not None
+                and total_memory > self.__max_memory
+            )
+        ):
+            _, evicted = self.__loaded.popitem(last=False)
+            if self.__max_memory is not None:
+                total_memory -= evicted.current_memory()
+            logger.info("Сценарий %s выгружен", evicted.id.value)
+
+    def reload_changed(self) -> list[ScenarioID]:
+        """
+        Перезагрузить сценарии, версия которых изменилась после загрузки.
+        Новая версия строится вне обработки запросов и подменяет прежнюю
+        одним присваиванием, поэтому запросы не ждут перезагрузки
+        """
+        if self.__version is None:
+            return []
+
+        with self.__lock:
+            loaded = list(self.__loaded.values())
+
+        reloaded = list[ScenarioID]()
+        for item in loaded:
+            try:
+                if self.__version(item.id) == item.version:
+                    continue
+
+                new_item = self.__make(item.id)
+            except Exception:
+                # при ошибке продолжает работать прежняя версия
+                logger.exception(
+                    "Не удалось перезагрузить сценарий %s",
+                    item.id.value,
+                )
+                continue
+
+            with self.__lock:
+                # выгруженный за время загрузки сценарий не возвращается
+                if item.id in self.__loaded:
+                    self.__loaded[item.id] = new_item
+                    reloaded.append(item.id)
+                    logger.info(
+                        "Сценарий %s обновлён до версии %s",
+                        item.id.value,
+                        new_item.version,
+                    )
+
+        return reloaded
+
+    def watch(self, interval: float):
+        """
+        Проверять изменения загруженных сценариев каждые interval секунд
+        в фоновом потоке текущего процесса. Повторный вызов в том же
+        процессе ничего не делает. Рабочим процессам поток не передаётся
+        при fork: в каждом из них watch вызывается после порождения
+        """
+        with self.__lock:
+            if self.__watching == os.getpid():
+                return
+
+            self.__watching = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.reload_changed()
+
+        threading.Thread(
+            target=run,
+            name="scenario-reload",
+            daemon=True,
+        ).start()
+
+    def warm_up(self):
+        """
+        Построить индексы загруженных сценариев заранее. Вызывается
+        перед порождением рабочих процессов, чтобы индексы разделялись
+        ими, а не строились в каждом процессе при первых запросах
+        """
+        with self.__lock:
+            loaded = list(self.__loaded.values())
+
+        for item in loaded:
+            if item.classificator is not None:
+                item.classificator.warm_up()
+
+    def unload(self, id: ScenarioID):
+        """Выгрузить сценарий из памяти"""
+        with self.__lock:
+            self.__loaded.pop(id, None)
+
+    def stats(self) -> dict:
+        """Статистика загруженных сценариев (в порядке от давно используемых)"""
+        with self.__lock:
+            loaded = list(self.__loaded.values())
+
+        memory = [item.current_memory() for item in loaded]
+        return {
+            "count": len(loaded),
+            "memory": None if None in memory else sum(memory),
+            "scenarios": [
+                {
+                    "id": item.id.value,
+                    "load_time": item.load_time,
+                    "memory": size,
+                    "version": item.version,
+                    "memo": (
+                        None
+                        if item.classificator is None
+                        else item.classificator.memo_stats()
+                    ),
+                }
+                for item, size in zip(loaded, memory)
+            ],
+        }
+
+    def handle(self, path: str, event: dict) -> dict:
+        """
+        Обработать событие платформы для сценария, указанного в пути запроса
+        @path - путь вида "/<id сценария>"
+        """
+        route = path.strip("/").split("/")[0]
+        if not route.isdigit():
+            raise RouteNotFound(f'Не указан сценарий в пути "{path}"')
+
+        return process(self.get(ScenarioID(int(route))).engine, event)
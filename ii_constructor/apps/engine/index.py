@@ -21,67 +21,68 @@
 
 import os
 
-from iiconstructor_core.domain import Engine, State
-from iiconstructor_core.domain.primitives import (
-    StateName,
-    Request,
-    Response,
-    ScenarioID,
-    StateID,
-)
-from iiconstructor_levenshtain import LevenshtainClassificator
-from mysqlrepo import HostingMySQL
-
-ip = os.environ.get("IP")
-port = int(os.environ.get("PORT"))
-username = os.environ.get("USER")
-password = os.environ.get("PASSWORD")
-scenario_id = int(os.environ.get("SCENARIO_ID"))
-
-hosting = HostingMySQL()
-hosting.connect(ip, port, username, password)
-scenario = hosting.get_scenario(ScenarioID(scenario_id))
-start_state: State = scenario.get_states_by_name(StateName("Старт"))[0]
-engine = Engine(LevenshtainClassificator(scenario), start_state)
+from alice import process
+from host import EngineHost, per_process
+from iiconstructor_core.domain.porst import ScenarioInterface
+from iiconstructor_core.domain.primitives import ScenarioID
+
+snapshot = os.environ.get("SNAPSHOT")
+
+if snapshot is not None:
+    from iiconstructor_inmemory.snapshot import load_snapshot
+
+    # снимок сценария отображается в память, БД не нужна
+    def load(id: ScenarioID) -> ScenarioInterface:
+        return load_snapshot(snapshot)
+
+    def version(id: ScenarioID) -> int:
+        # версия снимка - время изменения файла
+        return os.stat(snapshot).st_mtime_ns
+
+    scenario_id = int(os.environ.get("SCENARIO_ID", 0))
+
+else:
+    from iiconstructor_inmemory.compiled import compile_scenario
+    from mysqlrepo import HostingMySQL
+
+    ip = os.environ.get("IP")
+    port = int(os.environ.get("PORT"))
+    username = os.environ.get("USER")
+    password = os.environ.get("PASSWORD")
+    scenario_id = int(os.environ.get("SCENARIO_ID"))
+
+    # подключение к БД своё у каждого процесса (рабочие процессы
+    # сервера порождаются fork после холодного старта)
+    def connect() -> HostingMySQL:
+        hosting = HostingMySQL()
+        hosting.connect(ip, port, username, password)
+        return hosting
+
+    get_hosting = per_process(connect)
+
+    # сценарий загружается из БД при холодном старте (и при обновлении),
+    # дальше обработка запросов выполняется только в памяти
+    def load(id: ScenarioID) -> ScenarioInterface:
+        return compile_scenario(get_hosting().get_scenario(id))
+
+    def version(id: ScenarioID) -> int:
+        return get_hosting().version(id)
+
+
+host = EngineHost(load, version=version)
+loaded = host.get(ScenarioID(scenario_id))
+# сценарий и движок на момент холодного старта
+scenario = loaded.scenario
+engine = loaded.engine
+
+# при заданном RELOAD_INTERVAL изменённый сценарий перезагружается в фоне;
+# поток проверки запускается при первом запросе в каждом процессе, а не
+# при импорте, чтобы не оказаться в процессе до fork рабочих процессов
+reload_interval = os.environ.get("RELOAD_INTERVAL")
 
 
 def handler(event, context):
-    if (
-        "request" in event
-        and "original_utterance" in event["request"]
-        and event["request"]["original_utterance"] != ""
-        and event["request"]["original_utterance"] == "ping"
-    ):
-        return {
-            "version": 1,
-            "session": 1,
-            "response": {"text": "pong", "end_session": True},
-        }
-
-    session_store = event["state"]["session"]
-
-    resp = Response()
-
-    cur_state: State
-    if event["session"]["new"]:
-        cur_state = scenario.get_states_by_name(StateName("Старт"))[0]
-        resp.text = cur_state.attributes.name.value
-
-        session_store = {"state": cur_state.id().value}
-
-    else:
-        cur_state_id = StateID(event["state"]["session"]["state"])
-        cur_state = scenario.states([cur_state_id])[cur_state_id]
-        engine.set_current_state(cur_state)
-
-        req = Request()
-        req.text = event["request"]["command"]
-        resp = engine.handle(req)
-        session_store["state"] = engine.current_state().id().value
-
-    return {
-        "version": event["version"],
-        "session": event["session"],
-        "session_state": session_store,
-        "response": {"text": resp.text, "end_session": False},
-    }
+    if reload_interval is not None:
+        host.watch(float(reload_interval))
+
+    return process(host.get(ScenarioID(scenario_id)).engine, event)
@@ -0,0 +1,249 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import json
+import logging
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Executor
+from http import HTTPStatus
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[str, dict], dict]
+""" обработчик события платформы: (путь запроса, событие) -> ответ """
+
+StatsProvider = Callable[[], dict]
+""" источник статистики для GET /stats """
+
+MAX_BODY_SIZE = 1024 * 1024
+""" наибольший размер тела запроса по умолчанию, байт """
+
+MAX_HEADERS = 100
+""" наибольшее число строк заголовков запроса (больше - ответ 431) """
+
+READ_TIMEOUT = 30.0
+""" время ожидания строки запроса, заголовка или тела по умолчанию, с """
+
+
+class RouteNotFound(Exception):
+    """Обработчик не нашёл адресата запроса (ответ 404)"""
+
+
+class EngineServer:
+    """
+    Долгоживущий HTTP-сервер (asyncio) для обработки событий платформы.
+    Принимает POST-запросы с JSON-событием (формат навыков Алисы)
+    и отвечает JSON-ответом обработчика. Одно соединение может
+    передавать несколько запросов (keep-alive), сессии обслуживаются
+    конкурентно. Обработчик вызывается в executor'е, чтобы
+    классификация не блокировала цикл событий.
+    """
+
+    __handler: EventHandler
+    __executor: Executor | None
+    __stats: StatsProvider | None
+    __max_body_size: int
+    """ наибольший размер тела запроса, байт (больше - ответ 413) """
+    __read_timeout: float
+    """ время ожидания данных от клиента, с (потом соединение закрывается) """
+
+    def __init__(
+        self,
+        handler: EventHandler,
+        executor: Executor | None = None,
+        stats: StatsProvider | None = None,
+        max_body_size: int = MAX_BODY_SIZE,
+        read_timeout: float = READ_TIMEOUT,
+    ) -> None:
+        self.__handler = handler
+        self.__executor = executor
+        self.__stats = stats
+        self.__max_body_size = max_body_size
+        self.__read_timeout = read_timeout
+
+    async def serve(self, host: str, port: int):
+        """Запустить сервер и обслуживать запросы до остановки"""
+        server = await asyncio.start_server(self.__on_connection, host, port)
+        logger.info("Сервер запущен на %s:%s", host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def __on_connection(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        try:
+            while await self.__on_request(reader, writer):
+                pass
+
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            asyncio.TimeoutError,
+            ConnectionError,
+            ValueError,
+        ):
+            # клиент отключился, молчит дольше read_timeout
+            # или прислал строку длиннее буфера чтения
+            pass
+
+        finally:
+            writer.close()
+
+    async def __on_request(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> bool:
+        """Обработать один запрос. Возвращает True, если соединение остаётся открытым"""
+        try:
+            request_line = await self.__read(reader.readline())
+        except ValueError:
+            # строка длиннее буфера чтения (LimitOverrunError в readline)
+            await self.__respond(writer, HTTPStatus.BAD_REQUEST, None, False)
+            return False
+
+        if not request_line:
+            return False
+
+        try:
+            method, path, version = request_line.decode("latin-1").split()
+        except ValueError:
+            await self.__respond(writer, HTTPStatus.BAD_REQUEST, None, False)
+            return False
+
+        headers = dict[str, str]()
+        count = 0
+        while True:
+            try:
+                line = await self.__read(reader.readline())
+            except ValueError:
+                line = None
+
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+            # строк больше MAX_HEADERS или строка длиннее буфера чтения
+            count += 1
+            if line is None or count > MAX_HEADERS:
+                await self.__respond(
+                    writer,
+                    HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                    None,
+                    False,
+                )
+                return False
+
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        # размер тела проверяется до чтения: клиент не может заставить
+        # сервер ждать или выделять память под произвольный объём
+        length = headers.get("content-length", "0")
+        if not length.isdigit() or not length.isascii():
+            await self.__respond(writer, HTTPStatus.BAD_REQUEST, None, False)
+            return False
+
+        if int(length) > self.__max_body_size:
+            await self.__respond(
+                writer,
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                None,
+                False,
+            )
+            return False
+
+        body = b""
+        if int(length) > 0:
+            body = await self.__read(reader.readexactly(int(length)))
+
+        keep_alive = (
+            version == "HTTP/1.1"
+            and headers.get("connection", "").lower() != "close"
+        )
+
+        status, payload = await self.__dispatch(method, path, body)
+        await self.__respond(writer, status, payload, keep_alive)
+        return keep_alive
+
+    async def __read(self, read: Awaitable[bytes]) -> bytes:
+        """Дождаться данных от клиента не дольше read_timeout"""
+        return await asyncio.wait_for(read, self.__read_timeout)
+
+    async def __dispatch(
+        self,
+        method: str,
+        path: str,
+        body: bytes,
+    ) -> tuple[HTTPStatus, dict | None]:
+        if method == "GET" and path == "/health":
+            return HTTPStatus.OK, {"status": "ok"}
+
+        if method == "GET" and path == "/stats" and self.__stats is not None:
+            return HTTPStatus.OK, self.__stats()
+
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, None
+
+        try:
+            event = json.loads(body)
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, None
+
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                self.__executor,
+                self.__handler,
+                path,
+                event,
+            )
+        except RouteNotFound:
+            return HTTPStatus.NOT_FOUND, None
+
+        except Exception:
+            logger.exception("Ошибка обработки запроса %s", path)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, None
+
+        return HTTPStatus.OK, result
+
+    @staticmethod
+    async def __respond(
+        writer: asyncio.StreamWriter,
+        status: HTTPStatus,
+        payload: dict | None,
+        keep_alive: bool,
+    ):
+        body = b""
+        if payload is not None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+        head = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            "Content-Type: application/json; charset=utf-8",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        writer.write(body)
+        await writer.drain()
@@ -0,0 +1,70 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+import gc
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+
+from server import EventHandler
+
+_handler: EventHandler | None = None
+""" обработчик, унаследованный рабочими процессами при fork """
+
+
+def handle(path: str, event: dict) -> dict:
+    """Точка входа рабочего процесса (передаётся в executor по имени)"""
+    return _handler(path, event)
+
+
+def start_workers(
+    handler: EventHandler,
+    count: int,
+    initializer: Callable[[], None] | None = None,
+) -> ProcessPoolExecutor:
+    """
+    Запустить count рабочих процессов, обрабатывающих события handler'ом.
+    Процессы порождаются через fork сразу, поэтому всё, что загружено
+    до вызова (скомпилированные сценарии), разделяется между ними
+    в режиме копирования при записи. Запросы распределяются между
+    свободными процессами общей очередью пула.
+    @initializer - вызывается в каждом процессе после fork (например,
+    запуск фоновых потоков, которые нельзя запускать до fork)
+    """
+    global _handler
+    _handler = handler
+
+    # объекты, созданные до fork, исключаются из сборки мусора,
+    # чтобы её обход не копировал разделяемые страницы памяти
+    gc.collect()
+    gc.freeze()
+
+    pool = ProcessPoolExecutor(
+        count,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=initializer,
+    )
+
+    # порождаем процессы до запуска цикла событий
+    for future in [pool.submit(int) for _ in range(count)]:
+        future.result()
+
+    return pool
@@ -19,16 +19,26 @@
 # см. <https://www.gnu.org/licenses/>.
 
 
-from xml.etree.ElementTree import Element, fromstring, indent, tostring
+from collections.abc import Iterator
+from io import StringIO
+from typing import BinaryIO, TextIO
+from xml.etree.ElementTree import Element, iterparse
+from xml.sax.saxutils import XMLGenerator
 
 from iiconstructor_core.domain import (
     Connection,
     Hosting,
+    Scenario,
     State,
     Step,
 )
 from iiconstructor_core.domain.exceptions import CoreException, Exists
 from iiconstructor_core.domain.porst import ScenarioInterface
+from iiconstructor_core.infrastructure.cache import CachingSource
+from iiconstructor_core.infrastructure.dump import (
+    ScenarioDump,
+    ScenarioItem,
+)
 from iiconstructor_answers.plaintext import (
     PlainTextAnswer,
     PlainTextDescription,
@@ -46,11 +56,50 @@ from iiconstructor_core.domain.primitives import (
     StateAttributes,
     StateID,
 )
+from iiconstructor_inmemory.snapshot import write_snapshot
 from iiconstructor_levenshtain import LevenshtainVector, Synonym
-from iiconstructor_maria.repo import SourceMariaDB
+from iiconstructor_maria.repo import HostingMaria, SourceMariaDB
 from PySide6.QtWidgets import QMessageBox, QWidget
 
 
+class _XMLWriter:
+    """Потоковая запись XML с отступами (как у ElementTree.indent)"""
+
+    __gen: XMLGenerator
+    __depth: int
+    __has_children: list[bool]
+
+    def __init__(self, out: TextIO) -> None:
+        self.__gen = XMLGenerator(out, "utf-8", short_empty_elements=True)
+        self.__depth = 0
+        self.__has_children = []
+
+    def __newline(self):
+        if self.__depth > 0:
+            self.__gen.ignorableWhitespace("\n" + "  " * self.__depth)
+
+    def start(self, tag: str, attrs: dict[str, str] | None = None):
+        if self.__has_children:
+            self.__has_children[-1] = True
+        self.__newline()
+        self.__gen.startElement(tag, attrs or {})
+        self.__has_children.append(False)
+        self.__depth += 1
+
+    def end(self, tag: str):
+        self.__depth -= 1
+        if self.__has_children.pop():
+            self.__newline()
+            if self.__depth == 0:
+                self.__gen.ignorableWhitespace("\n")
+        self.__gen.endElement(tag)
+
+    def leaf(self, tag: str, attrs: dict[str, str], text: str):
+        self.start(tag, attrs)
+        self.__gen.characters(text)
+        self.end(tag)
+
+
 class HostingManipulator:
     @staticmethod
     def make_scenario(
@@ -58,7 +107,7 @@ class HostingManipulator:
         info: SourceInfo,
     ) -> "ScenarioAPI":
         """создаёт заготовку сценария для алисы"""
-        new_scenario = hosting.get_scenario(hosting.add_source(info))
+        new_scenario = _cached(hosting.get_scenario(hosting.add_source(info)))
 
         new_scenario.create_enter_state(
             LevenshtainVector(
@@ -96,74 +145,151 @@ class HostingManipulator:
         return ScenarioAPI(new_scenario)
 
     @staticmethod
-    def load_scenario(
-        hosting: Hosting,
-        data: str,
-        id_map: dict[int, int] = None,
-    ) -> "ScenarioAPI":
-        """id_map: key - orig, val - new"""
-        root: Element = fromstring(data)
+    def iter_scenario(file: TextIO | BinaryIO) -> Iterator[ScenarioItem]:
+        """
+        читает сценарий из файла в формате файла сохранения по частям:
+        сведения о проекте, вектора, состояния, входы и переходы выдаются
+        по мере разбора, обработанные элементы удаляются, поэтому
+        документ целиком в памяти не хранится
+        """
+        opened = list[Element]()
+        state_from_id: StateID | None = None
+        state_to_id: StateID | None = None
+
+        for event, elem in iterparse(file, ("start", "end")):
+            if event == "start":
+                opened.append(elem)
+
+                if elem.tag == "сценарий":
+                    yield SourceInfo(
+                        ProjectName(elem.attrib["Название"]),
+                        Description(elem.attrib["Краткое_описание"]),
+                    )
+                elif elem.tag == "Связи":
+                    state_from_id = StateID(int(elem.attrib["Состояние"]))
+                elif elem.tag == "Переход":
+                    state_to_id = StateID(int(elem.attrib["В_состояние"]))
 
-        info = SourceInfo(
-            ProjectName(root.attrib["Название"]),
-            Description(root.attrib["Краткое_описание"]),
-        )
-        scenario = hosting.get_scenario(hosting.add_source(info))
+                continue
+
+            opened.pop()
+            if not opened:  # корневой элемент
+                break
 
-        # добавляем векторы
-        for elem in root.find("Управляющие_воздействия").findall("Описание"):
-            synonyms = list[Synonym]()
-            for synonym in elem.findall("Синоним"):
-                synonyms.append(Synonym(synonym.text))
+            parent = opened[-1]
 
-            scenario.add_vector(
-                LevenshtainVector(
+            # векторы
+            if elem.tag == "Описание":
+                synonyms = list[Synonym]()
+                for synonym in elem.findall("Синоним"):
+                    synonyms.append(Synonym(synonym.text))
+
+                yield LevenshtainVector(
                     VectorName(elem.attrib["Название"]),
                     synonyms,
-                ),
-            )
+                )
 
-        # добавляем состояния
-        for elem in root.find("Состояния").findall("Состояние"):
-            state: State = scenario.source().create_state(
-                StateAttributes(
-                    StateName(elem.attrib["Название"]),
-                    Description(""),
-                ),
-                PlainTextDescription(PlainTextAnswer(elem.text)),
-            )
-            if id_map is not None:
-                id_map[int(elem.attrib["Идентификатор"])] = state.id().value
+            # состояния
+            elif elem.tag == "Состояние":
+                yield State(
+                    StateID(int(elem.attrib["Идентификатор"])),
+                    StateAttributes(
+                        StateName(elem.attrib["Название"]),
+                        Description(""),
+                    ),
+                    PlainTextDescription(PlainTextAnswer(elem.text)),
+                )
 
-        # добавляем входы
-        for elem in root.find("Входы").findall("Точка_входа"):
-            if id_map is None:
-                id = StateID(int(elem.attrib["Состояние"]))
-            else:
-                id = StateID(id_map[int(elem.attrib["Состояние"])])
+            # входы
+            elif elem.tag == "Точка_входа":
+                yield StateID(int(elem.attrib["Состояние"]))
+
+            # переходы
+            elif (
+                elem.tag == "Управляющее_воздействие"
+                and parent.tag == "Переход"
+            ):
+                yield (
+                    state_from_id,
+                    state_to_id,
+                    VectorName(elem.attrib["Название"]),
+                )
 
-            scenario.make_enter(id)
+            # синонимы нужны при обработке вектора
+            elif elem.tag == "Синоним":
+                continue
 
-        # добавляем переходы
-        for elem in root.find("Переходы").findall("Связи"):
-            if id_map is None:
-                state_from_id = StateID(int(elem.attrib["Состояние"]))
-            else:
-                state_from_id = StateID(id_map[int(elem.attrib["Состояние"])])
+            parent.remove(elem)
 
-            for step in elem.findall("Переход"):
-                if id_map is None:
-                    state_to_id = StateID(int(step.attrib["В_состояние"]))
-                else:
-                    state_to_id = StateID(
-                        id_map[int(step.attrib["В_состояние"])],
+    @staticmethod
+    def read_scenario(file: TextIO | BinaryIO) -> ScenarioDump:
+        """читает и проверяет сценарий из файла в формате файла сохранения"""
+        dump = ScenarioDump.collect(HostingManipulator.iter_scenario(file))
+        dump.validate()
+        return dump
+
+    @staticmethod
+    def parse_scenario(data: str) -> ScenarioDump:
+        """разбирает и проверяет сценарий из строки в формате файла сохранения"""
+        return HostingManipulator.read_scenario(StringIO(data))
+
+    @staticmethod
+    def load_scenario(
+        hosting: Hosting,
+        data: str | TextIO | BinaryIO,
+        id_map: dict[int, int] = None,
+    ) -> "ScenarioAPI":
+        """
+        data: строка или открытый файл
+        id_map: key - orig, val - new
+        файл разбирается один раз: в БД элементы проверяются и записываются
+        по мере разбора одной транзакцией (при ошибке она откатывается)
+        """
+        if isinstance(data, str):
+            data = StringIO(data)
+
+        if isinstance(hosting, HostingMaria):
+            # в БД сценарий записывается многострочными запросами
+            scenario_id, states_map = hosting.import_scenario(
+                HostingManipulator.iter_scenario(data),
+            )
+            if id_map is not None:
+                for orig_id, new_id in states_map.items():
+                    id_map[orig_id.value] = new_id.value
+
+            return ScenarioAPI(_cached(hosting.get_scenario(scenario_id)))
+
+        # изменения в памяти не откатываются: сценарий проверяется целиком
+        # до записи (в памяти он окажется всё равно)
+        items = HostingManipulator.read_scenario(data).items()
+        scenario = hosting.get_scenario(hosting.add_source(next(items)))
+
+        # весь сценарий сохраняется одним пакетом изменений
+        with scenario.batch():
+            states_map = dict[StateID, StateID]()
+            for item in items:
+                if isinstance(item, InputDescription):
+                    scenario.add_vector(item)
+
+                elif isinstance(item, State):
+                    new_state: State = scenario.source().create_state(
+                        item.attributes,
+                        item.output(),
                     )
+                    states_map[item.id()] = new_state.id()
+                    if id_map is not None:
+                        id_map[item.id().value] = new_state.id().value
 
-                for input in step.findall("Управляющее_воздействие"):
-                    _vector = scenario.get_vector(
-                        VectorName(input.attrib["Название"]),
+                elif isinstance(item, StateID):
+                    scenario.make_enter(states_map[item])
+
+                else:
+                    state_from_id, state_to_id, vector_name = item
+                    scenario.create_step_between(
+                        states_map[state_from_id],
+                        states_map[state_to_id],
+                        scenario.get_vector(vector_name),
                     )
-                    scenario.create_step_between(state_from_id, state_to_id, _vector)
 
         return ScenarioAPI(scenario)
 
@@ -172,7 +298,18 @@ class HostingManipulator:
         hosting: Hosting,
         id: int,
     ) -> "ScenarioAPI":
-        return ScenarioAPI(hosting.get_scenario(ScenarioID(id)))
+        return ScenarioAPI(_cached(hosting.get_scenario(ScenarioID(id))))
+
+
+def _cached(scenario: ScenarioInterface) -> ScenarioInterface:
+    """
+    Сценарий из БД с кэшированием чтений
+    (сценарий изменяется только через этот экземпляр)
+    """
+    if not isinstance(scenario.source(), SourceMariaDB):
+        return scenario
+
+    return Scenario(CachingSource(scenario.source()))
 
 
 class ScenarioAPI:
@@ -191,7 +328,11 @@ class ScenarioAPI:
         return self.__scenario.source().info.description.value
 
     def in_db(self) -> bool:
-        return isinstance(self.__scenario.source(), SourceMariaDB)
+        source = self.__scenario.source()
+        if isinstance(source, CachingSource):
+            source = source.origin()
+
+        return isinstance(source, SourceMariaDB)
 
     # TODO заменить собственным интерфейсом
     def interface(self) -> ScenarioInterface:
@@ -357,10 +498,21 @@ class ScenarioAPI:
     def save_to_file(self):
         """сохраняет сценарий в файл"""
 
-    def serialize(self) -> str:
+    def serialize(self, embed_synonyms: bool = True) -> str:
         """сформировать строку для сохранения в файл"""
+        out = StringIO()
+        self.write(out, embed_synonyms)
+        return out.getvalue()
 
-        root = Element(
+    def write(self, out: TextIO, embed_synonyms: bool = True):
+        """
+        записывает сценарий в файл по мере обхода (без построения дерева)
+        @embed_synonyms - дублировать синонимы векторов во входах и переходах
+        (загрузчику достаточно имени, синонимы берутся из "Управляющие_воздействия")
+        """
+        xml = _XMLWriter(out)
+
+        xml.start(
             "сценарий",
             {
                 "Идентификатор": str(self.id()),
@@ -368,102 +520,85 @@ class ScenarioAPI:
                 "Краткое_описание": self.description(),
             },
         )
-        vectors = Element("Управляющие_воздействия")
-        states = Element("Состояния")
-        enters = Element("Входы")
-        steps = Element("Переходы")
-
-        root.append(vectors)
-        root.append(states)
-        root.append(enters)
-        root.append(steps)
 
+        xml.start("Управляющие_воздействия")
         for vector in self.__scenario.select_vectors():
             if isinstance(vector, LevenshtainVector):
-                _vector = Element(
-                    "Описание",
-                    {
-                        "Название": vector.name().value,
-                        "Тип": "Группа синонимов",
-                    },
-                )
-                for index in range(len(vector)):
-                    input = vector.value(index)
-                    _synonym = Element("Синоним")
-                    _synonym.text = input.value()
-                    _vector.append(_synonym)
-                vectors.append(_vector)
+                self.__write_vector(xml, "Описание", vector, True)
+        xml.end("Управляющие_воздействия")
 
+        xml.start("Состояния")
         for state in self.__scenario.states().values():
             state: State = state
-            _state = Element(
+            xml.leaf(
                 "Состояние",
                 {
                     "Идентификатор": str(state.id().value),
                     "Название": state.attributes.name.value,
                 },
+                state.output().value().as_text(),
             )
-            _state.text = state.output().value().as_text()
-            states.append(_state)
+        xml.end("Состояния")
 
         connections = self.__scenario.source().get_all_connections()
+
+        xml.start("Входы")
         for enter_state_id in connections["to"].keys():
             enter_conn: Connection = connections["to"][enter_state_id]
-            _enter = Element(
-                "Точка_входа",
-                {"Состояние": str(enter_state_id.value)},
-            )
-
+            xml.start("Точка_входа", {"Состояние": str(enter_state_id.value)})
             for step in enter_conn.steps:
-                vector: LevenshtainVector = step.input
-                if isinstance(vector, LevenshtainVector):
-                    _vector = Element(
+                if isinstance(step.input, LevenshtainVector):
+                    self.__write_vector(
+                        xml,
                         "Управляющее_воздействие",
-                        {
-                            "Название": vector.name().value,
-                            "Тип": "Группа синонимов",
-                        },
+                        step.input,
+                        embed_synonyms,
                     )
-                    for index in range(len(vector)):
-                        input = vector.value(index)
-                        _synonym = Element("Синоним")
-                        _synonym.text = input.value()
-                        _vector.append(_synonym)
-                    _enter.append(_vector)
-
-            enters.append(_enter)
+            xml.end("Точка_входа")
+        xml.end("Входы")
 
+        xml.start("Переходы")
         for from_state_id in connections["from"].keys():
-            _conn = Element("Связи", {"Состояние": str(from_state_id.value)})
+            xml.start("Связи", {"Состояние": str(from_state_id.value)})
             for conn in connections["from"][from_state_id]:
                 conn: Connection = conn  # просто аннотирование
-                _step = Element(
+                xml.start(
                     "Переход",
                     {"В_состояние": str(conn.to_state.id().value)},
                 )
                 for step in conn.steps:
-                    vector: LevenshtainVector = step.input
-                    if isinstance(vector, LevenshtainVector):
-                        _vector = Element(
+                    if isinstance(step.input, LevenshtainVector):
+                        self.__write_vector(
+                            xml,
                             "Управляющее_воздействие",
-                            {
-                                "Название": vector.name().value,
-                                "Тип": "Группа синонимов",
-                            },
+                            step.input,
+                            embed_synonyms,
                         )
-                        for index in range(len(vector)):
-                            input = vector.value(index)
-                            _synonym = Element("Синоним")
-                            _synonym.text = input.value()
-                            _vector.append(_synonym)
-                        _step.append(_vector)
+                xml.end("Переход")
+            xml.end("Связи")
+        xml.end("Переходы")
 
-                _conn.append(_step)
+        xml.end("сценарий")
 
-            steps.append(_conn)
+    def write_snapshot(self, out: BinaryIO):
+        """записывает двоичный снимок сценария для движка"""
+        write_snapshot(self.__scenario.source(), out)
 
-        indent(root)
-        return tostring(root, "unicode")
+    @staticmethod
+    def __write_vector(
+        xml: "_XMLWriter",
+        tag: str,
+        vector: LevenshtainVector,
+        with_synonyms: bool,
+    ):
+        xml.start(
+            tag,
+            {"Название": vector.name().value, "Тип": "Группа синонимов"},
+        )
+        if with_synonyms:
+            for index in range(len(vector)):
+                xml.leaf("Синоним", {}, vector.value(index).value())
+        xml.end(tag)
 
     def check_can_create_enter_state(self, name: str):
         """проверяет условия для создания точки входа в новое состояние"""
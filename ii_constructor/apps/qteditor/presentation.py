@@ -86,6 +86,9 @@ from PySide6.QtWidgets import (
     QWidget,
 )
 
+SCENARIO_FILTER = "Сценарий (*)"
+SNAPSHOT_FILTER = "Снимок для движка (*.iisnap)"
+
 
 class Project:
     __synonym_create_callback: Callable
@@ -393,13 +396,24 @@ class ProjectManager:
             self.__main_window,
             "Сохранить в файл",
             "Новый сценарий",
+            f"{SCENARIO_FILTER};;{SNAPSHOT_FILTER}",
         )
 
         if not path:
             return
 
+        if filetype == SNAPSHOT_FILTER or path.endswith(".iisnap"):
+            # снимок для движка: только чтение, без расположения элементов.
+            # файл подменяется целиком, т.к. движок может держать его в mmap
+            with open(path + ".tmp", "wb") as file:
+                manipulator.write_snapshot(file)
+            os.replace(path + ".tmp", path)
+            return
+
+        # синонимы хранятся только в описании векторов,
+        # во входах и переходах вектора указываются по имени
         with open(path, "w") as file:
-            file.write(manipulator.serialize())
+            manipulator.write(file, embed_synonyms=False)
 
         with open(path + ".lay", "w") as lay_file:
             lay_file.write(scene_ctrl.serialize_layout())
@@ -642,15 +656,12 @@ class ProjectManager:
         if not path:
             return
 
-        data: str
+        # создание проекта (файл разбирается по мере чтения)
         with open(path) as file:
-            data = "".join(file.readlines())
-
-        # создание проекта
-        manipulator = HostingManipulator.load_scenario(
-            self.__inmem_hosting,
-            data,
-        )
+            manipulator = HostingManipulator.load_scenario(
+                self.__inmem_hosting,
+                file,
+            )
         scene_ctrl = self.__open_project(manipulator)
 
         lay_path = path + ".lay"
@@ -717,16 +728,13 @@ class ProjectManager:
                 if not path:
                     return
 
-                data: str
-                with open(path) as file:
-                    data = "".join(file.readlines())
-
                 map = dict[int, int]()
-                manipulator = HostingManipulator.load_scenario(
-                    self.__maria_hosting,
-                    data,
-                    map,
-                )
+                with open(path) as file:
+                    manipulator = HostingManipulator.load_scenario(
+                        self.__maria_hosting,
+                        file,
+                        map,
+                    )
                 scene_ctrl = self.__open_project(manipulator)
 
                 lay_path = path + ".lay"
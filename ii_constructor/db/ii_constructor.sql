@@ -30,7 +30,8 @@ SET time_zone = "+00:00";
 CREATE TABLE `projects` (
   `id` int(11) NOT NULL,
   `name` varchar(50) NOT NULL,
-  `description` varchar(255) NOT NULL DEFAULT ''
+  `description` varchar(255) NOT NULL DEFAULT '',
+  `version` bigint(20) NOT NULL DEFAULT 0
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3 COLLATE=utf8mb3_general_ci;
 
 -- --------------------------------------------------------
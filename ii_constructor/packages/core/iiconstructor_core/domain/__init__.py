@@ -19,11 +19,14 @@
 # см. <https://www.gnu.org/licenses/>.
 
 
+import weakref
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 from dataclasses import dataclass
 from typing import Any, Optional
 
 from .exceptions import CoreException, Exists, NotExists
-from .porst import ScenarioInterface
+from .porst import ScenarioInterface, ScenarioListener
 from iiconstructor_answers.domain import (
     OutputDescription,
 )
@@ -197,56 +200,137 @@ class Connection:
     steps: list[Step]
 
 
-class StepVectorBaseClassificator:
+class StepVectorBaseClassificator(ScenarioListener):
     __project: ScenarioInterface
 
+    __steps_index: dict[StateID, tuple[State, Any]]
+    """ индекс переходов: id состояния -> (состояние, подготовленные варианты переходов из него) """
+
+    __enters_index: Any | None
+    """ подготовленные варианты переходов по точкам входа (None - требуется построение) """
+
+    __states_usage: dict[StateID, set[StateID]]
+    """ состояния, записи индекса которых ссылаются на состояние (для инвалидации) """
+
+    __vectors_usage: dict[VectorName, set[StateID]]
+    """ состояния, записи индекса которых используют вектор (для инвалидации) """
+
+    __enters_states: set[StateID]
+    __enters_vectors: set[VectorName]
+
     def __init__(self, project: ScenarioInterface) -> None:
         self.__project = project
 
+        self.__steps_index = {}
+        self.__enters_index = None
+        self.__states_usage = {}
+        self.__vectors_usage = {}
+        self.__enters_states = set()
+        self.__enters_vectors = set()
+
+        project.add_listener(self)
+
     def calc(
         self,
         cur_input: Input,
-        possible_inputs: dict[str, State],
+        possible_inputs: Any,
     ) -> State | None:
-        """Вычисления"""
+        """
+        Вычисления
+        @cur_input - управляющее воздействие
+        @possible_inputs - результат prepare() для возможных переходов
+        """
         raise NotImplementedError
 
+    def prepare(
+        self,
+        possible_inputs: list[tuple[InputDescription, State]],
+    ) -> Any:
+        """
+        Подготовка вариантов переходов (вектор, целевое состояние) к сопоставлению.
+        Вызывается один раз при построении записи индекса, результат передаётся в calc
+        """
+        return possible_inputs
+
+    def prepare_enters(
+        self,
+        possible_inputs: list[tuple[InputDescription, State]],
+    ) -> Any:
+        """
+        Подготовка вариантов переходов по точкам входа к сопоставлению.
+        По умолчанию совпадает с prepare()
+        """
+        return self.prepare(possible_inputs)
+
+    def __make_inputs(
+        self,
+        targets: dict[VectorName, State],
+    ) -> list[tuple[InputDescription, State]]:
+        if len(targets) == 0:
+            return []
+
+        return [
+            (vector, targets[vector.name()])
+            for vector in self.__project.select_vectors(list(targets.keys()))
+        ]
+
     def __prepare_to_step_detect(
         self,
         cur_state_id: StateID,
-    ) -> dict[str, State]:
-        inputs = dict[str, State]()
+    ) -> tuple[State, Any]:
+        cur_state = self.__project.states([cur_state_id])[cur_state_id]
+
+        targets = dict[VectorName, State]()
         for step in self.__project.steps(cur_state_id):
             step: Step = step
 
-            cur_state = step.connection.from_state
-            if cur_state is None or cur_state.id() != cur_state_id:
+            from_state = step.connection.from_state
+            if from_state is None or from_state.id() != cur_state_id:
                 continue
 
-            inputs[step.input.name().value] = step.connection.to_state
+            to_state: State = step.connection.to_state
+            targets[step.input.name()] = to_state
+            self.__states_usage.setdefault(to_state.id(), set()).add(
+                cur_state_id,
+            )
+
+        for name in targets.keys():
+            self.__vectors_usage.setdefault(name, set()).add(cur_state_id)
 
-        return inputs
+        entry = (cur_state, self.prepare(self.__make_inputs(targets)))
+        self.__steps_index[cur_state_id] = entry
+        return entry
 
-    def __prepare_to_enter_detect(self) -> dict[str, State]:
-        inputs = dict[str, State]()
+    def __prepare_to_enter_detect(self) -> Any:
+        targets = dict[VectorName, State]()
 
-        for conn in (
-            self.__project.source().get_all_connections()["to"].values()
-        ):
+        for conn in self.__project.source().get_enters().values():
             conn: Connection = conn
             to: State = conn.to_state
 
             for step in conn.steps:
-                inputs[step.input.name().value] = to
+                targets[step.input.name()] = to
+
+        self.__enters_states = {state.id() for state in targets.values()}
+        self.__enters_vectors = set(targets.keys())
 
-        return inputs
+        self.__enters_index = self.prepare_enters(self.__make_inputs(targets))
+        return self.__enters_index
 
     def get_next_state(self, cmd: Input, cur_state_id: StateID) -> State:
-        cur_state = self.__project.states([cur_state_id])[cur_state_id]
+        entry = self.__steps_index.get(cur_state_id)
+        if entry is None:
+            entry = self.__prepare_to_step_detect(cur_state_id)
+
+        cur_state, step_inputs = entry
 
         callable_list = [
-            lambda: self.__prepare_to_step_detect(cur_state_id),
-            lambda: self.__prepare_to_enter_detect(),
+            lambda: step_inputs,
+            lambda: (
+                self.__enters_index
+                if self.__enters_index is not None
+                else self.__prepare_to_enter_detect()
+            ),
         ]
 
         for get_inputs in callable_list:
@@ -258,6 +342,42 @@ class StepVectorBaseClassificator:
 
         return cur_state
 
+    def warm_up(self):
+        """
+        Построить индекс для всех состояний и точек входа заранее,
+        а не при первом обращении к ним
+        """
+        for state_id in self.__project.states().keys():
+            if state_id not in self.__steps_index:
+                self.__prepare_to_step_detect(state_id)
+
+        if self.__enters_index is None:
+            self.__prepare_to_enter_detect()
+
+    # инвалидация индекса при изменении сценария
+
+    def on_state_changed(self, state_id: StateID):
+        self.__steps_index.pop(state_id, None)
+
+        for using_state_id in self.__states_usage.pop(state_id, set()):
+            self.__steps_index.pop(using_state_id, None)
+
+        if state_id in self.__enters_states:
+            self.__enters_index = None
+
+    def on_steps_changed(self, state_id: StateID):
+        self.__steps_index.pop(state_id, None)
+
+    def on_enters_changed(self):
+        self.__enters_index = None
+
+    def on_vector_changed(self, name: VectorName):
+        for using_state_id in self.__vectors_usage.pop(name, set()):
+            self.__steps_index.pop(using_state_id, None)
+
+        if name in self.__enters_vectors:
+            self.__enters_index = None
+
 
 class Source:
     id: ScenarioID | None
@@ -273,6 +393,26 @@ class Source:
     def save_lay(self, id: StateID, x: float, y: float):
         """сохранить положение состояния"""
 
+    def begin(self):
+        """
+        Начать пакет изменений: до commit изменения выполняются
+        одной транзакцией (вложенные пакеты входят во внешний).
+        Хранилище может откладывать запись изменений до commit
+        """
+
+    def commit(self):
+        """сохранить пакет изменений"""
+
+    def rollback(self):
+        """отменить пакет изменений"""
+
+    def version(self) -> int | None:
+        """
+        Версия сценария: увеличивается при каждом сохранённом изменении,
+        позволяет дешёвым опросом узнать, не изменил ли сценарий кто-то ещё
+        (None - хранилище не отслеживает версии)
+        """
+
     def delete_state(self, state_id: StateID):
         """удалить состояние"""
 
@@ -366,6 +506,37 @@ class Source:
     ):
         """удаляет переходы и связи"""
 
+    def get_enters(self) -> dict[StateID, Connection]:
+        """
+        получить связи точек входа (ключ - id состояния входа).
+        по умолчанию выбираются из get_all_connections()
+        """
+        return self.get_all_connections()["to"]
+
+    def get_step_links(
+        self,
+    ) -> list[tuple[StateID | None, StateID, VectorName]]:
+        """
+        получить все переходы в виде (из состояния - None для входа,
+        в состояние, имя вектора) без создания состояний и векторов.
+        по умолчанию выбираются из get_all_connections()
+        """
+        connections = self.get_all_connections()
+        result = list[tuple[StateID | None, StateID, VectorName]]()
+
+        for to_id, conn in connections["to"].items():
+            for step in conn.steps:
+                result.append((None, to_id, step.input.name()))
+
+        for from_id, conn_list in connections["from"].items():
+            for conn in conn_list:
+                for step in conn.steps:
+                    result.append(
+                        (from_id, conn.to_state.id(), step.input.name()),
+                    )
+
+        return result
+
     def get_all_connections(self) -> dict[str, dict]:
         """
         !!! DEPRECATED !!!\n
@@ -411,15 +582,38 @@ class Hosting:
 
 class Scenario(ScenarioInterface):
     __src: Source
+    __listeners: "weakref.WeakSet[ScenarioListener]"
 
     # Scenario public
 
     def __init__(self, src: Source) -> None:
         self.__src = src
+        self.__listeners = weakref.WeakSet()
 
     def source(self) -> Source:
         return self.__src
 
+    def add_listener(self, listener: ScenarioListener):
+        self.__listeners.add(listener)
+
+    def remove_listener(self, listener: ScenarioListener):
+        self.__listeners.discard(listener)
+
+    def __notify(self, event: Callable[[ScenarioListener], None]):
+        for listener in list(self.__listeners):
+            event(listener)
+
+    @contextmanager
+    def batch(self) -> Iterator["Scenario"]:
+        self.__src.begin()
+        try:
+            yield self
+        except BaseException:
+            self.__src.rollback()
+            raise
+
+        self.__src.commit()
+
     def get_layouts(self) -> str:
         return self.__src.get_layouts()
 
@@ -481,6 +675,7 @@ class Scenario(ScenarioInterface):
 
         input_name = VectorName(state_to.attributes.name.value)
         self.__src.new_step(None, state_to.id(), input_name)
+        self.__notify(lambda listener: listener.on_enters_changed())
 
     def create_step_between(
         self,
@@ -488,7 +683,9 @@ class Scenario(ScenarioInterface):
         to_state: StateID,
         input: InputDescription,
     ) -> Step:
-        return self.__src.new_step(from_state_id, to_state, input.name())
+        step = self.__src.new_step(from_state_id, to_state, input.name())
+        self.__notify(lambda listener: listener.on_steps_changed(from_state_id))
+        return step
 
     def create_step_to_new(
         self,
@@ -507,7 +704,9 @@ class Scenario(ScenarioInterface):
                 )
 
         state_to = self.__src.create_state(to_state, output)
-        return self.__src.new_step(from_state_id, state_to.id(), input.name())
+        step = self.__src.new_step(from_state_id, state_to.id(), input.name())
+        self.__notify(lambda listener: listener.on_steps_changed(from_state_id))
+        return step
 
     # удаление сущностей
 
@@ -523,6 +722,7 @@ class Scenario(ScenarioInterface):
             )
 
         self.__src.delete_state(state_id)
+        self.__notify(lambda listener: listener.on_state_changed(state_id))
 
     def remove_enter(self, state_id: StateID):
         """удаляет связь с командой входа в состояние"""
@@ -532,6 +732,7 @@ class Scenario(ScenarioInterface):
             raise Exception("Обязательную точку входа нельзя удалить!")
 
         self.__src.delete_step(None, state_id)
+        self.__notify(lambda listener: listener.on_enters_changed())
 
     def remove_step(self, from_state_id: StateID, input: InputDescription):
         """
@@ -540,6 +741,7 @@ class Scenario(ScenarioInterface):
         @input: управляющее воздействие
         """
         self.__src.delete_step(from_state_id, None, input.name())
+        self.__notify(lambda listener: listener.on_steps_changed(from_state_id))
 
     # геттеры
 
@@ -564,6 +766,7 @@ class Scenario(ScenarioInterface):
     def set_answer(self, state_id: StateID, data: OutputDescription):
         """Изменить ответ состояния"""
         self.__src.set_answer(state_id, data)
+        self.__notify(lambda listener: listener.on_state_changed(state_id))
 
     # векторы
 
@@ -588,13 +791,21 @@ class Scenario(ScenarioInterface):
         if self.check_vector_exists(input.name()):
             raise _Exists(self.get_vector(input.name()))
 
-        return self.__src.add_vector(input)
+        result = self.__src.add_vector(input)
+        self.__notify(lambda listener: listener.on_vector_changed(input.name()))
+        return result
 
     def remove_vector(self, name: VectorName):
         self.__src.remove_vector(name)
+        self.__notify(lambda listener: listener.on_vector_changed(name))
 
     def update_vector(self, name: VectorName, input: InputDescription):
         self.__src.update_vector(name, input)
+        self.__notify(lambda listener: listener.on_vector_changed(name))
+        if input.name() != name:
+            self.__notify(
+                lambda listener: listener.on_vector_changed(input.name()),
+            )
 
     def check_vector_exists(self, name: VectorName) -> bool:
         """
@@ -643,6 +854,7 @@ class Scenario(ScenarioInterface):
                         )
 
         self.__src.rename_state(state, name)
+        self.__notify(lambda listener: listener.on_state_changed(state))
 
     def rename_vector(self, old_name: VectorName, new_name: VectorName):
         """переименовывает группу синонимов"""
@@ -660,13 +872,27 @@ class Scenario(ScenarioInterface):
 
         except NotExists:
             self.__src.rename_vector(old_name, new_name)
+            self.__notify(
+                lambda listener: listener.on_vector_changed(old_name),
+            )
+            self.__notify(
+                lambda listener: listener.on_vector_changed(new_name),
+            )
 
         except Exception:
             raise
 
 
 class Engine:
+    """
+    Обработчик запросов к сценарию.
+    step() не хранит состояние между вызовами и может вызываться
+    конкурентно из нескольких потоков; handle() - обёртка над step(),
+    запоминающая текущее состояние
+    """
+
     __classif: StepVectorBaseClassificator
+    __start_state: State
     __cur_state: State
 
     def __init__(
@@ -675,26 +901,47 @@ class Engine:
         start_state: State,
     ) -> None:
         self.__classif = classif
+        self.__start_state = start_state
         self.__cur_state = start_state
 
-    def handle(self, request: Request) -> Response:
-        req = request.text
-        prev_state = self.__cur_state.id()
-
-        self.__cur_state = self.__classif.get_next_state(
-            StrInput(req),
-            self.__cur_state.id(),
+    def __step(
+        self,
+        state_id: StateID,
+        request: Request,
+    ) -> tuple[State, Response]:
+        new_state = self.__classif.get_next_state(
+            StrInput(request.text),
+            state_id,
         )
 
         result = Response()
 
-        if prev_state == self.__cur_state.id():
+        if state_id == new_state.id():
             result.text = "Запрос не понятен"
         else:
-            result.text = self.__cur_state.output().value().as_text()
+            result.text = new_state.output().value().as_text()
+
+        return new_state, result
+
+    def step(
+        self,
+        state_id: StateID,
+        request: Request,
+    ) -> tuple[StateID, Response]:
+        """
+        Обработать запрос в состоянии state_id
+        Возвращает идентификатор нового состояния и ответ
+        """
+        new_state, result = self.__step(state_id, request)
+        return new_state.id(), result
 
+    def handle(self, request: Request) -> Response:
+        self.__cur_state, result = self.__step(self.__cur_state.id(), request)
         return result
 
+    def start_state(self) -> State:
+        return self.__start_state
+
     def set_current_state(self, state: State):
         self.__cur_state = state
 
@@ -30,7 +30,35 @@ from iiconstructor_inputvectors.domain import (
     VectorName,
 )
 
+class ScenarioListener:
+    """Интерфейс подписчика на изменения сценария"""
+
+    def on_state_changed(self, state_id: StateID):
+        """Изменились аттрибуты или ответ состояния, либо состояние удалено"""
+
+    def on_steps_changed(self, state_id: StateID):
+        """Изменились переходы из состояния"""
+
+    def on_enters_changed(self):
+        """Изменились точки входа"""
+
+    def on_vector_changed(self, name: VectorName):
+        """Изменился вектор управляющих воздействий"""
+
+
 class ScenarioInterface:
+    def add_listener(self, listener: ScenarioListener):
+        """подписать на изменения сценария"""
+
+    def remove_listener(self, listener: ScenarioListener):
+        """отписать от изменений сценария"""
+
+    def batch(self):
+        """
+        Контекстный менеджер пакета изменений: все изменения внутри блока with
+        сохраняются одной транзакцией, при исключении - отменяются
+        """
+
     def get_layouts(self) -> str:
         """получить строку данные отобрадения"""
 
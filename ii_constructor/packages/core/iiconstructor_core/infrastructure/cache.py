@@ -0,0 +1,607 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any
+
+from iiconstructor_answers.domain import OutputDescription
+from iiconstructor_core.domain import Connection, Source, State, Step
+from iiconstructor_core.domain.exceptions import NotExists
+from iiconstructor_core.domain.primitives import (
+    StateAttributes,
+    StateID,
+    StateName,
+)
+from iiconstructor_inputvectors.domain import InputDescription, VectorName
+
+
+class LRUCache:
+    """Ограниченный по числу записей кэш с вытеснением давно не использованных"""
+
+    __data: OrderedDict
+    __max_size: int
+    __on_evict: Callable[[Hashable, Any], None] | None
+
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(
+        self,
+        max_size: int,
+        on_evict: Callable[[Hashable, Any], None] | None = None,
+    ) -> None:
+        """
+        @max_size - наибольшее число записей
+        @on_evict - вызывается для вытесненной или удалённой записи
+        """
+        self.__data = OrderedDict()
+        self.__max_size = max_size
+        self.__on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.__data
+
+    def __sizeof__(self) -> int:
+        # размер таблицы записей (без самих ключей и значений)
+        return object.__sizeof__(self) + sys.getsizeof(self.__data)
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        """Возвращает (найдено, значение), найденная запись становится свежей"""
+        if key not in self.__data:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        self.__data.move_to_end(key)
+        return True, self.__data[key]
+
+    def put(self, key: Hashable, value: Any):
+        if key in self.__data:
+            self.__remove(key)
+
+        self.__data[key] = value
+        while len(self.__data) > self.__max_size:
+            old_key = next(iter(self.__data))
+            self.__remove(old_key)
+            self.evictions += 1
+
+    def keys(self) -> list[Hashable]:
+        """Ключи от давно не использованных к свежим"""
+        return list(self.__data.keys())
+
+    def pop(self, key: Hashable):
+        if key in self.__data:
+            self.__remove(key)
+
+    def clear(self):
+        for key in list(self.__data.keys()):
+            self.__remove(key)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.__data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __remove(self, key: Hashable):
+        value = self.__data.pop(key)
+        if self.__on_evict is not None:
+            self.__on_evict(key, value)
+
+
+class CachingSource(Source):
+    """
+    Кэширующая обёртка над любым хранилищем.
+    Чтения (состояния, переходы, вектора, точки входа) обслуживаются
+    из памяти, изменения передаются хранилищу и сбрасывают только
+    затронутые записи кэша. Изменения в обход обёртки (другими процессами)
+    замечаются по версии сценария (Source.version), которая опрашивается
+    не чаще check_interval: при её изменении кэш сбрасывается целиком.
+    """
+
+    __src: Source
+    __lock: threading.Lock
+
+    __generation: int
+    """ номер изменения: прочитанное до изменения в кэш не попадает """
+
+    __states: LRUCache
+    """ StateID -> State """
+
+    __steps: LRUCache
+    """ StateID -> tuple[Step, ...] """
+
+    __enters: LRUCache
+    """ StateID -> bool """
+
+    __vectors: LRUCache
+    """ VectorName -> InputDescription | None (None - вектора нет) """
+
+    __queries: LRUCache
+    """ выборки: все состояния, все вектора, состояния по имени """
+
+    __steps_by_state: dict[StateID, set[StateID]]
+    """ записи __steps, в которых упоминается состояние """
+
+    __steps_by_vector: dict[VectorName, set[StateID]]
+    """ записи __steps, в которых используется вектор """
+
+    __check_interval: float | None
+    __checked: float
+    """ время последней проверки версии (time.monotonic) """
+
+    __version: int | None
+    """ версия сценария, которой соответствует кэш """
+
+    __depth: int
+    """ вложенность пакета изменений """
+
+    def __init__(
+        self,
+        src: Source,
+        max_size: int = 1024,
+        check_interval: float | None = 1.0,
+    ) -> None:
+        """
+        @src - исходное хранилище
+        @max_size - наибольшее число записей в каждой таблице кэша
+        @check_interval - период проверки версии сценария (с), None - не проверять
+        """
+        super().__init__(src.id, src.info)
+        self.__src = src
+        self.__lock = threading.Lock()
+        self.__generation = 0
+        self.__check_interval = check_interval
+        self.__checked = time.monotonic()
+        self.__version = src.version()
+        self.__depth = 0
+
+        self.__states = LRUCache(max_size)
+        self.__steps = LRUCache(max_size, self.__forget_steps)
+        self.__enters = LRUCache(max_size)
+        self.__vectors = LRUCache(max_size)
+        self.__queries = LRUCache(max_size)
+        self.__steps_by_state = {}
+        self.__steps_by_vector = {}
+
+    def origin(self) -> Source:
+        """Исходное хранилище"""
+        return self.__src
+
+    def stats(self) -> dict:
+        """Счётчики попаданий и промахов кэша (всего и по таблицам)"""
+        with self.__lock:
+            tables = {
+                "states": self.__states.stats(),
+                "steps": self.__steps.stats(),
+                "enters": self.__enters.stats(),
+                "vectors": self.__vectors.stats(),
+                "queries": self.__queries.stats(),
+            }
+
+        return {
+            "hits": sum(table["hits"] for table in tables.values()),
+            "misses": sum(table["misses"] for table in tables.values()),
+            "tables": tables,
+        }
+
+    def clear(self):
+        """Сбросить весь кэш"""
+        with self.__lock:
+            self.__generation += 1
+            for cache in self.__caches():
+                cache.clear()
+
+    # версия
+
+    def version(self) -> int | None:
+        return self.__src.version()
+
+    def __poll(self):
+        """Сбросить кэш, если сценарий изменили в обход обёртки"""
+        if self.__check_interval is None or self.__version is None:
+            return
+
+        now = time.monotonic()
+        if now - self.__checked < self.__check_interval:
+            return
+
+        self.__checked = now
+        version = self.__src.version()
+        if version != self.__version:
+            self.clear()
+            self.__version = version
+
+    def __changed(self):
+        """
+        Учесть версию после собственного изменения: если кроме него
+        изменений не было, сбрасывать кэш целиком не нужно
+        """
+        if self.__depth > 0 or self.__version is None:
+            return
+
+        version = self.__src.version()
+        if version not in (self.__version, self.__version + 1):
+            self.clear()
+
+        self.__version = version
+        self.__checked = time.monotonic()
+
+    # служебное
+
+    def __caches(self) -> tuple[LRUCache, ...]:
+        return (
+            self.__states,
+            self.__steps,
+            self.__enters,
+            self.__vectors,
+            self.__queries,
+        )
+
+    def __lookup(self, cache: LRUCache, key: Hashable) -> tuple[bool, Any, int]:
+        with self.__lock:
+            found, value = cache.get(key)
+            return found, value, self.__generation
+
+    def __store(
+        self,
+        generation: int,
+        cache: LRUCache,
+        key: Hashable,
+        value: Any,
+    ):
+        with self.__lock:
+            if generation == self.__generation:
+                cache.put(key, value)
+
+    def __forget_steps(self, key: StateID, steps: tuple[Step, ...]):
+        for state_id in _step_states(steps):
+            keys = self.__steps_by_state.get(state_id)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.__steps_by_state[state_id]
+
+        for step in steps:
+            keys = self.__steps_by_vector.get(step.input.name())
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.__steps_by_vector[step.input.name()]
+
+    def __invalidate_state(self, state_id: StateID, *names: StateName):
+        """Сбросить записи, содержащие состояние (вызывать под блокировкой)"""
+        self.__generation += 1
+        self.__states.pop(state_id)
+        self.__steps.pop(state_id)
+        for key in list(self.__steps_by_state.get(state_id, ())):
+            self.__steps.pop(key)
+
+        self.__queries.pop(("states",))
+        for name in names:
+            self.__queries.pop(("by_name", name))
+
+    def __invalidate_steps(self, *state_ids: StateID | None):
+        """Сбросить переходы состояний (вызывать под блокировкой)"""
+        self.__generation += 1
+        for state_id in state_ids:
+            if state_id is None:
+                continue
+
+            self.__steps.pop(state_id)
+            self.__enters.pop(state_id)
+            for key in list(self.__steps_by_state.get(state_id, ())):
+                self.__steps.pop(key)
+
+    def __invalidate_vector(self, *names: VectorName):
+        """Сбросить записи, содержащие вектор (вызывать под блокировкой)"""
+        self.__generation += 1
+        self.__queries.pop(("vectors",))
+        for name in names:
+            self.__vectors.pop(name)
+            for key in list(self.__steps_by_vector.get(name, ())):
+                self.__steps.pop(key)
+
+    def __state_name(self, state_id: StateID) -> StateName | None:
+        try:
+            return self.states([state_id])[state_id].attributes.name
+        except NotExists:
+            return None
+
+    # пакеты изменений
+
+    def begin(self):
+        self.__src.begin()
+        self.__depth += 1
+
+    def commit(self):
+        self.__src.commit()
+        self.__depth -= 1
+        self.__changed()
+
+    def rollback(self):
+        self.__src.rollback()
+        self.__depth -= 1
+        # в кэш могли попасть отменённые изменения
+        self.clear()
+        if self.__depth == 0 and self.__version is not None:
+            self.__version = self.__src.version()
+
+    # чтение
+
+    def get_layouts(self) -> str:
+        return self.__src.get_layouts()
+
+    def save_lay(self, id: StateID, x: float, y: float):
+        self.__src.save_lay(id, x, y)
+
+    def get_states_by_name(self, name: StateName) -> list[State]:
+        self.__poll()
+        key = ("by_name", name)
+        found, states, generation = self.__lookup(self.__queries, key)
+        if not found:
+            states = self.__src.get_states_by_name(name)
+            self.__store(generation, self.__queries, key, states)
+
+        return list(states)
+
+    def states(self, ids: list[StateID] = None) -> dict[StateID, State]:
+        self.__poll()
+        if ids is None:
+            key = ("states",)
+            found, states, generation = self.__lookup(self.__queries, key)
+            if not found:
+                states = self.__src.states()
+                self.__store(generation, self.__queries, key, states)
+
+            return dict(states)
+
+        result = dict[StateID, State]()
+        missing = list[StateID]()
+        with self.__lock:
+            generation = self.__generation
+            for id in ids:
+                found, state = self.__states.get(id)
+                if found:
+                    result[id] = state
+                else:
+                    missing.append(id)
+
+        if len(missing) > 0:
+            loaded = self.__src.states(missing)
+            for id, state in loaded.items():
+                self.__store(generation, self.__states, id, state)
+            result.update(loaded)
+
+        return {id: result[id] for id in ids if id in result.keys()}
+
+    def steps(self, state_id: StateID) -> list[Step]:
+        self.__poll()
+        found, steps, generation = self.__lookup(self.__steps, state_id)
+        if found:
+            return list(steps)
+
+        steps = tuple(self.__src.steps(state_id))
+        with self.__lock:
+            if generation == self.__generation:
+                self.__steps.put(state_id, steps)
+                for id in _step_states(steps):
+                    self.__steps_by_state.setdefault(id, set()).add(state_id)
+                for step in steps:
+                    self.__steps_by_vector.setdefault(
+                        step.input.name(),
+                        set(),
+                    ).add(state_id)
+
+        return list(steps)
+
+    def is_enter(self, state: State) -> bool:
+        self.__poll()
+        found, result, generation = self.__lookup(self.__enters, state.id())
+        if not found:
+            result = self.__src.is_enter(state)
+            self.__store(generation, self.__enters, state.id(), result)
+
+        return result
+
+    def select_vectors(
+        self,
+        names: list[VectorName] | None = None,
+    ) -> list[InputDescription]:
+        self.__poll()
+        if names is None:
+            key = ("vectors",)
+            found, vectors, generation = self.__lookup(self.__queries, key)
+            if not found:
+                vectors = self.__src.select_vectors()
+                self.__store(generation, self.__queries, key, vectors)
+
+            return list(vectors)
+
+        cached = dict[VectorName, InputDescription | None]()
+        missing = list[VectorName]()
+        with self.__lock:
+            generation = self.__generation
+            for name in names:
+                found, vector = self.__vectors.get(name)
+                if found:
+                    cached[name] = vector
+                else:
+                    missing.append(name)
+
+        if len(missing) > 0:
+            loaded = dict[VectorName, InputDescription | None]()
+            for vector in self.__src.select_vectors(missing):
+                loaded[vector.name()] = vector
+            for name in missing:
+                loaded.setdefault(name, None)
+                self.__store(generation, self.__vectors, name, loaded[name])
+            cached.update(loaded)
+
+        return [cached[name] for name in names if cached[name] is not None]
+
+    def get_vector(self, name: VectorName) -> InputDescription:
+        self.__poll()
+        found, vector, generation = self.__lookup(self.__vectors, name)
+        if not found:
+            try:
+                vector = self.__src.get_vector(name)
+            except NotExists:
+                vector = None
+            self.__store(generation, self.__vectors, name, vector)
+
+        if vector is None:
+            raise NotExists(name, f'Вектор с именем "{name.value}"')
+
+        return vector
+
+    def check_vector_exists(self, name: VectorName) -> bool:
+        self.__poll()
+        found, vector, _ = self.__lookup(self.__vectors, name)
+        if found:
+            return vector is not None
+
+        return self.__src.check_vector_exists(name)
+
+    def find_connections_to(self, state_id: StateID) -> list[Connection]:
+        return self.__src.find_connections_to(state_id)
+
+    def input_usage(self, input: InputDescription) -> list[Connection]:
+        return self.__src.input_usage(input)
+
+    def get_all_connections(self) -> dict[str, dict]:
+        return self.__src.get_all_connections()
+
+    def get_step_links(
+        self,
+    ) -> list[tuple[StateID | None, StateID, VectorName]]:
+        return self.__src.get_step_links()
+
+    # изменения
+
+    def delete_state(self, state_id: StateID):
+        name = self.__state_name(state_id)
+        self.__src.delete_state(state_id)
+        with self.__lock:
+            self.__invalidate_state(state_id, name)
+            self.__invalidate_steps(state_id)
+        self.__changed()
+
+    def set_answer(self, state_id: StateID, data: OutputDescription):
+        name = self.__state_name(state_id)
+        self.__src.set_answer(state_id, data)
+        with self.__lock:
+            self.__invalidate_state(state_id, name)
+        self.__changed()
+
+    def rename_state(self, state: StateID, name: StateName):
+        old_name = self.__state_name(state)
+        self.__src.rename_state(state, name)
+        with self.__lock:
+            self.__invalidate_state(state, old_name, name)
+        self.__changed()
+
+    def create_state(
+        self,
+        attributes: StateAttributes,
+        output: OutputDescription,
+        required: bool = False,
+    ) -> State:
+        state = self.__src.create_state(attributes, output, required)
+        with self.__lock:
+            self.__invalidate_state(state.id(), attributes.name)
+        self.__changed()
+
+        return state
+
+    def new_step(
+        self,
+        from_state: StateID | None,
+        to_state: StateID,
+        input_name: VectorName,
+    ) -> Step:
+        step = self.__src.new_step(from_state, to_state, input_name)
+        with self.__lock:
+            self.__invalidate_steps(from_state, to_state)
+        self.__changed()
+
+        return step
+
+    def delete_step(
+        self,
+        from_state: StateID | None,
+        to_state: StateID | None,
+        input_name: VectorName | None = None,
+    ):
+        self.__src.delete_step(from_state, to_state, input_name)
+        # без to_state целевое состояние неизвестно: сбрасываются
+        # все записи, где упоминается from_state (в т.ч. у целевого)
+        with self.__lock:
+            self.__invalidate_steps(from_state, to_state)
+        self.__changed()
+
+    def add_vector(self, input: InputDescription):
+        self.__src.add_vector(input)
+        with self.__lock:
+            self.__invalidate_vector(input.name())
+        self.__changed()
+
+    def remove_vector(self, name: VectorName):
+        self.__src.remove_vector(name)
+        with self.__lock:
+            self.__invalidate_vector(name)
+        self.__changed()
+
+    def update_vector(self, name: VectorName, input: InputDescription):
+        self.__src.update_vector(name, input)
+        with self.__lock:
+            self.__invalidate_vector(name, input.name())
+        self.__changed()
+
+    def rename_vector(self, old_name: VectorName, new_name: VectorName):
+        self.__src.rename_vector(old_name, new_name)
+        with self.__lock:
+            self.__invalidate_vector(old_name, new_name)
+        self.__changed()
+
+
+def _step_states(steps: tuple[Step, ...]) -> set[StateID]:
+    """Состояния, упоминаемые в переходах"""
+    result = set[StateID]()
+    for step in steps:
+        if step.connection.from_state is not None:
+            result.add(step.connection.from_state.id())
+        result.add(step.connection.to_state.id())
+
+    return result
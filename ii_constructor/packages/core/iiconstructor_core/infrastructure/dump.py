@@ -0,0 +1,154 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+
+from iiconstructor_core.domain import State
+from iiconstructor_core.domain.exceptions import CoreException, Exists, NotExists
+from iiconstructor_core.domain.primitives import SourceInfo, StateID
+from iiconstructor_inputvectors.domain import InputDescription, VectorName
+
+ScenarioStep = tuple[StateID, StateID, VectorName]
+""" переход (из состояния, в состояние, вектор) """
+
+ScenarioItem = SourceInfo | InputDescription | State | StateID | ScenarioStep
+"""
+элемент сценария, читаемого по частям: сведения о проекте (первым),
+вектор, состояние, точка входа (id состояния) или переход
+"""
+
+
+@dataclass
+class ScenarioDump:
+    """
+    Сценарий целиком в памяти (например, прочитанный из файла)
+    для загрузки в хранилище одним пакетом.
+    Идентификаторы состояний - исходные, хранилище назначает новые.
+    """
+
+    info: SourceInfo
+    vectors: list[InputDescription] = field(default_factory=list)
+    states: list[State] = field(default_factory=list)
+    enters: list[StateID] = field(default_factory=list)
+    """ состояния-входы (команда входа - вектор с именем состояния) """
+
+    steps: list[ScenarioStep] = field(default_factory=list)
+    """ переходы (из состояния, в состояние, вектор) """
+
+    @staticmethod
+    def collect(items: Iterable[ScenarioItem]) -> "ScenarioDump":
+        """Собрать сценарий из элементов, читаемых по частям"""
+        dump: ScenarioDump | None = None
+        for item in items:
+            if isinstance(item, SourceInfo):
+                dump = ScenarioDump(item)
+            elif isinstance(item, InputDescription):
+                dump.vectors.append(item)
+            elif isinstance(item, State):
+                dump.states.append(item)
+            elif isinstance(item, StateID):
+                dump.enters.append(item)
+            else:
+                dump.steps.append(item)
+
+        return dump
+
+    def items(self) -> Iterator[ScenarioItem]:
+        """Элементы сценария в порядке загрузки в хранилище"""
+        yield self.info
+        yield from self.vectors
+        yield from self.states
+        yield from self.enters
+        yield from self.steps
+
+    def validate(self):
+        """Проверить целостность ссылок до записи в хранилище"""
+        validate_items(self.items())
+
+
+def validate_items(items: Iterable[ScenarioItem]):
+    """Проверить целостность ссылок сценария, читаемого по частям"""
+    for _ in validated_items(items):
+        pass
+
+
+def validated_items(items: Iterable[ScenarioItem]) -> Iterator[ScenarioItem]:
+    """
+    Элементы сценария с проверкой по мере чтения: повторы отвергаются
+    сразу, ссылки (в файле они могут указывать вперёд) - после последнего
+    элемента. Запоминаются только имена и id, а не сами элементы, поэтому
+    элементы можно записывать в хранилище по мере чтения, а при ошибке
+    откатить транзакцию записи
+    """
+    vector_names = set[VectorName]()
+    state_names = dict[StateID, str]()
+    enters = dict[StateID, None]()
+    step_states = set[StateID]()
+    step_vectors = set[VectorName]()
+
+    for item in items:
+        if isinstance(item, SourceInfo):
+            pass
+
+        elif isinstance(item, InputDescription):
+            if item.name() in vector_names:
+                raise Exists(item, f'Вектор с именем "{item.name().value}"')
+            vector_names.add(item.name())
+
+        elif isinstance(item, State):
+            if item.id() in state_names.keys():
+                raise Exists(item, f'Состояние с id "{item.id().value}"')
+            state_names[item.id()] = item.attributes.name.value
+
+        elif isinstance(item, StateID):
+            if item in enters.keys():
+                raise Exists(item, f'Точка входа в состояние "{item.value}"')
+            enters[item] = None
+
+        else:
+            from_state, to_state, vector_name = item
+            step_states.add(from_state)
+            step_states.add(to_state)
+            step_vectors.add(vector_name)
+
+        yield item
+
+    for state_id in enters.keys():
+        if state_id not in state_names.keys():
+            raise NotExists(state_id, f'Состояние с id "{state_id.value}"')
+
+        name = state_names[state_id]
+        if VectorName(name) not in vector_names:
+            raise CoreException(
+                f'Для входа в состояние "{name}" нет вектора с таким же именем',
+            )
+
+    for state_id in step_states:
+        if state_id not in state_names.keys():
+            raise NotExists(state_id, f'Состояние с id "{state_id.value}"')
+
+    for vector_name in step_vectors:
+        if vector_name not in vector_names:
+            raise NotExists(
+                vector_name,
+                f'Вектор с именем "{vector_name.value}"',
+            )
@@ -0,0 +1,216 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from iiconstructor_core.domain.exceptions import CoreException
+
+
+def check_connection(conn: Any):
+    """Проверка подключения по умолчанию (DB-API): выполнить простой запрос"""
+    cur = conn.cursor()
+    cur.execute("SELECT 1")
+    cur.fetchall()
+
+
+class ConnectionPool:
+    """
+    Пул подключений к БД (DB-API 2.0).
+    Подключение выдаётся потоку на время блока `with pool.connection()`;
+    вложенные блоки в том же потоке получают то же подключение, поэтому
+    методы хранилища могут вызывать друг друга, не занимая лишних подключений.
+    Простаивавшие дольше check_interval подключения проверяются перед выдачей,
+    неисправные закрываются и заменяются новыми.
+    """
+
+    __connect: Callable[[], Any]
+    __check: Callable[[Any], None]
+    __min_size: int
+    __max_size: int
+    __check_interval: float
+    __timeout: float | None
+
+    __idle: list[tuple[Any, float]]
+    """ свободные подключения и время их возврата в пул """
+
+    __size: int
+    """ число открытых подключений (свободных и выданных) """
+
+    __cond: threading.Condition
+    __local: threading.local
+    __closed: bool
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        min_size: int = 1,
+        max_size: int = 8,
+        check_interval: float = 30.0,
+        timeout: float | None = 30.0,
+        check: Callable[[Any], None] = check_connection,
+    ) -> None:
+        """
+        @connect - функция открытия нового подключения
+        @min_size - число подключений, открываемых сразу и поддерживаемых в пуле
+        @max_size - наибольшее число одновременно открытых подключений
+        @check_interval - время простоя (с), после которого подключение проверяется
+        @timeout - время ожидания свободного подключения (с), None - без ограничения
+        @check - проверка подключения (должна поднять исключение, если оно неисправно)
+        """
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError("некорректный размер пула")
+
+        self.__connect = connect
+        self.__check = check
+        self.__min_size = min_size
+        self.__max_size = max_size
+        self.__check_interval = check_interval
+        self.__timeout = timeout
+
+        self.__idle = []
+        self.__size = 0
+        self.__cond = threading.Condition()
+        self.__local = threading.local()
+        self.__closed = False
+
+        for _ in range(min_size):
+            self.__idle.append((connect(), time.monotonic()))
+            self.__size += 1
+
+    def size(self) -> int:
+        """число открытых подключений"""
+        return self.__size
+
+    def idle(self) -> int:
+        """число свободных подключений"""
+        return len(self.__idle)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Получить подключение для текущего потока на время блока with"""
+        holder = getattr(self.__local, "holder", None)
+        if holder is not None:
+            holder[1] += 1
+            try:
+                yield holder[0]
+            finally:
+                holder[1] -= 1
+            return
+
+        conn = self.__acquire()
+        holder = [conn, 1]
+        self.__local.holder = holder
+        broken = False
+        try:
+            yield conn
+
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+
+        finally:
+            self.__local.holder = None
+            self.__release(conn, broken)
+
+    def close(self):
+        """Закрыть свободные подключения и запретить выдачу новых"""
+        with self.__cond:
+            self.__closed = True
+            idle, self.__idle = self.__idle, []
+            self.__size -= len(idle)
+            self.__cond.notify_all()
+
+        for conn, _ in idle:
+            self.__close(conn)
+
+    def __acquire(self) -> Any:
+        deadline = (
+            None if self.__timeout is None else time.monotonic() + self.__timeout
+        )
+
+        with self.__cond:
+            while True:
+                if self.__closed:
+                    raise CoreException("Пул подключений закрыт")
+
+                if self.__idle:
+                    conn, released = self.__idle.pop()
+                    break
+
+                if self.__size < self.__max_size:
+                    self.__size += 1
+                    conn, released = None, None
+                    break
+
+                remaining = (
+                    None if deadline is None else deadline - time.monotonic()
+                )
+                if remaining is not None and remaining <= 0:
+                    raise CoreException(
+                        "Нет свободных подключений к БД",
+                        "БД перегружена, повторите попытку позже",
+                    )
+                self.__cond.wait(remaining)
+
+        try:
+            if conn is None:
+                return self.__connect()
+
+            if time.monotonic() - released < self.__check_interval:
+                return conn
+
+            try:
+                self.__check(conn)
+                return conn
+            except Exception:
+                self.__close(conn)
+                return self.__connect()
+
+        except BaseException:
+            with self.__cond:
+                self.__size -= 1
+                self.__cond.notify()
+            raise
+
+    def __release(self, conn: Any, broken: bool):
+        with self.__cond:
+            if broken or self.__closed:
+                self.__size -= 1
+            else:
+                self.__idle.append((conn, time.monotonic()))
+            self.__cond.notify()
+
+        if broken or self.__closed:
+            self.__close(conn)
+
+    @staticmethod
+    def __close(conn: Any):
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,312 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+from iiconstructor_core.domain import (
+    Connection,
+    Scenario,
+    ScenarioInterface,
+    Source,
+    State,
+    Step,
+)
+from iiconstructor_core.domain.exceptions import CoreException, NotExists
+from iiconstructor_answers.domain import (
+    OutputDescription,
+)
+from iiconstructor_inputvectors.domain import (
+    InputDescription,
+    VectorName,
+)
+from iiconstructor_core.domain.primitives import (
+    StateName,
+    StateAttributes,
+    StateID,
+)
+from iiconstructor_levenshtain import (
+    LevenshtainVector,
+    StoredVector,
+    SynonymStore,
+)
+
+
+class ReadOnly(CoreException):
+    def __init__(self) -> None:
+        super().__init__("Сценарий доступен только для чтения")
+
+
+class ReadOnlySource(Source):
+    """Хранилище только для чтения: все изменения запрещены"""
+
+    def delete_state(self, state_id: StateID):
+        raise ReadOnly
+
+    def set_answer(self, state_id: StateID, data: OutputDescription):
+        raise ReadOnly
+
+    def add_vector(self, input: InputDescription):
+        raise ReadOnly
+
+    def remove_vector(self, name: VectorName):
+        raise ReadOnly
+
+    def update_vector(self, name: VectorName, input: InputDescription):
+        raise ReadOnly
+
+    def create_state(
+        self,
+        attributes: StateAttributes,
+        output: OutputDescription,
+        required: bool = False,
+    ) -> State:
+        raise ReadOnly
+
+    def new_step(
+        self,
+        from_state: StateID | None,
+        to_state: StateID,
+        input_name: VectorName,
+    ) -> Step:
+        raise ReadOnly
+
+    def delete_step(
+        self,
+        from_state: StateID | None,
+        to_state: StateID | None,
+        input_name: VectorName | None = None,
+    ):
+        raise ReadOnly
+
+    def rename_state(self, state: StateID, name: StateName):
+        raise ReadOnly
+
+    def rename_vector(self, old_name: VectorName, new_name: VectorName):
+        raise ReadOnly
+
+
+class SourceCompiled(ReadOnlySource):
+    """
+    Неизменяемое представление сценария, оптимизированное для чтения.
+    Сценарий целиком выгружается из исходного хранилища при создании,
+    после чего все запросы обслуживаются из памяти.
+    """
+
+    __states: dict[StateID, State]
+    """ таблица состояний """
+
+    __states_by_name: dict[StateName, list[State]]
+    """ таблица состояний по имени """
+
+    __vectors: dict[VectorName, InputDescription]
+    """ таблица векторов (наборы синонимов) """
+
+    __enters: dict[StateID, Connection]
+    """ таблица точек входа """
+
+    __outgoing: dict[StateID, list[Connection]]
+    """ таблица исходящих связей состояния """
+
+    __steps: dict[StateID, tuple[Step, ...]]
+    """ все переходы, связанные с состоянием """
+
+    __version: int | None
+    """ версия исходного сценария на момент выгрузки """
+
+    def __init__(self, src: Source) -> None:
+        super().__init__(src.id, src.info)
+        # версия читается до выгрузки: изменение во время выгрузки
+        # будет замечено при следующей проверке
+        self.__version = src.version()
+
+        self.__states = {}
+        self.__states_by_name = {}
+        for state in src.states().values():
+            _state = State(
+                state.id(),
+                StateAttributes(
+                    state.attributes.name,
+                    state.attributes.description,
+                ),
+                state.output(),
+                state.required,
+            )
+            self.__states[_state.id()] = _state
+            self.__states_by_name.setdefault(
+                _state.attributes.name,
+                [],
+            ).append(_state)
+
+        # синонимы всех векторов упаковываются в один неизменяемый буфер:
+        # классификатор сопоставляет ввод прямо с ним, а после fork
+        # буфер остаётся общим для рабочих процессов
+        vectors = src.select_vectors()
+        synonyms = list[str]()
+        bounds = dict[VectorName, range]()
+        for vector in vectors:
+            if isinstance(vector, LevenshtainVector):
+                begin = len(synonyms)
+                for index in range(len(vector)):
+                    synonyms.append(vector.value(index).value())
+                bounds[vector.name()] = range(begin, len(synonyms))
+
+        store = SynonymStore.build(synonyms)
+        self.__vectors = {}
+        for vector in vectors:
+            if vector.name() in bounds.keys():
+                vector = StoredVector(
+                    vector.name(),
+                    store,
+                    bounds[vector.name()],
+                )
+            self.__vectors[vector.name()] = vector
+
+        # переходы собираются в связи по уже выгруженным состояниям
+        # и векторам, сами они читаются без создания объектов
+        self.__enters = {}
+        self.__outgoing = {}
+        conns = dict[tuple[StateID | None, StateID], Connection]()
+        incoming = dict[StateID, list[Connection]]()
+        for from_id, to_id, vector_name in src.get_step_links():
+            _conn = conns.get((from_id, to_id))
+            if _conn is None:
+                _conn = Connection(
+                    None if from_id is None else self.__states[from_id],
+                    self.__states[to_id],
+                    [],
+                )
+                conns[(from_id, to_id)] = _conn
+
+                if from_id is None:
+                    self.__enters[to_id] = _conn
+                else:
+                    self.__outgoing.setdefault(from_id, []).append(_conn)
+                    # петля уже учтена среди исходящих
+                    if from_id != to_id:
+                        incoming.setdefault(to_id, []).append(_conn)
+
+            _conn.steps.append(Step(self.__vectors[vector_name], _conn))
+
+        self.__steps = {}
+        for state_id in self.__states.keys():
+            steps = list[Step]()
+
+            for conn in self.__outgoing.get(state_id, []):
+                steps.extend(conn.steps)
+
+            if state_id in self.__enters.keys():
+                steps.extend(self.__enters[state_id].steps)
+
+            for conn in incoming.get(state_id, []):
+                steps.extend(conn.steps)
+
+            self.__steps[state_id] = tuple(steps)
+
+    def version(self) -> int | None:
+        return self.__version
+
+    def get_layouts(self) -> str:
+        """-"""
+
+    def save_lay(self, id: StateID, x: float, y: float):
+        """-"""
+
+    def get_states_by_name(self, name: StateName) -> list[State]:
+        return list(self.__states_by_name.get(name, []))
+
+    def states(self, ids: list[StateID] = None) -> dict[StateID, State]:
+        if ids is None:
+            return dict(self.__states)
+
+        states = dict[StateID, State]()
+        for id in ids:
+            if id not in self.__states.keys():
+                raise NotExists(id, f'Нет состояния с id "{id.value}"')
+            states[id] = self.__states[id]
+
+        return states
+
+    def steps(self, state_id: StateID) -> list[Step]:
+        return list(self.__steps.get(state_id, ()))
+
+    def is_enter(self, state: State) -> bool:
+        return state.id() in self.__enters.keys()
+
+    def select_vectors(
+        self,
+        names: list[VectorName] | None = None,
+    ) -> list["InputDescription"]:
+        if names is None:
+            return list(self.__vectors.values())
+
+        result = list[InputDescription]()
+        for name in names:
+            result.append(self.get_vector(name))
+
+        return result
+
+    def get_vector(self, name: VectorName) -> InputDescription:
+        if name not in self.__vectors.keys():
+            raise NotExists(name, f'Вектор с именем "{name.value}"')
+
+        return self.__vectors[name]
+
+    def check_vector_exists(self, name: VectorName) -> bool:
+        return name in self.__vectors.keys()
+
+    def find_connections_to(self, state_id: StateID) -> list[Connection]:
+        result = list[Connection]()
+        for conn_list in self.__outgoing.values():
+            for conn in conn_list:
+                if conn.to_state.id() == state_id:
+                    result.append(conn)
+
+        return result
+
+    def input_usage(self, input: InputDescription) -> list[Connection]:
+        result = list[Connection]()
+
+        for conn in self.__enters.values():
+            for step in conn.steps:
+                if step.input == input:
+                    result.append(conn)
+                    break
+
+        for conn_list in self.__outgoing.values():
+            for conn in conn_list:
+                for step in conn.steps:
+                    if step.input == input:
+                        result.append(conn)
+                        break
+
+        return result
+
+    def get_enters(self) -> dict[StateID, Connection]:
+        return self.__enters
+
+    def get_all_connections(self) -> dict[str, dict]:
+        return {"from": self.__outgoing, "to": self.__enters}
+
+
+def compile_scenario(scenario: ScenarioInterface) -> Scenario:
+    """
+    Загружает сценарий целиком и возвращает его неизменяемую копию в памяти
+    @scenario - исходный сценарий (например, из БД)
+    """
+    return Scenario(SourceCompiled(scenario.source()))
@@ -0,0 +1,602 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+"""
+Двоичный снимок сценария для быстрого холодного старта движка.
+
+Формат (little-endian, версия 1):
+    заголовок: сигнатура, версия, id и строки названия/описания проекта,
+    число секций; затем таблица секций (смещение, размер в байтах);
+    секции - плоские массивы фиксированного порядка (см. _SECTIONS),
+    выровненные по 8 байт.
+
+Все строки хранятся один раз (интернированы) в общем UTF-8 буфере
+со смещениями, остальные таблицы ссылаются на них по номеру.
+Состояния упорядочены по id, вектора - по имени, переходы - по паре
+(из, в), для входящих переходов есть отдельный упорядоченный индекс,
+поэтому поиск выполняется двоичным поиском прямо по буферу (mmap),
+а объекты создаются только для тех элементов, к которым обратились.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import BinaryIO
+
+from iiconstructor_answers.plaintext import (
+    PlainTextAnswer,
+    PlainTextDescription,
+)
+from iiconstructor_core.domain import (
+    Connection,
+    Scenario,
+    Source,
+    State,
+    Step,
+)
+from iiconstructor_core.domain.exceptions import CoreException, NotExists
+from iiconstructor_core.domain.primitives import (
+    Description,
+    ProjectName,
+    ScenarioID,
+    SourceInfo,
+    StateAttributes,
+    StateID,
+    StateName,
+)
+from iiconstructor_inputvectors.domain import InputDescription, VectorName
+from iiconstructor_levenshtain import StoredVector, SynonymStore
+
+from .compiled import ReadOnlySource
+
+MAGIC = b"IICS"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sHHiIII")
+""" сигнатура, версия, резерв, id сценария, название, описание, число секций """
+
+_SECTION = struct.Struct("<QQ")
+""" смещение и размер секции """
+
+_SECTIONS = (
+    ("strings_offsets", "I"),
+    ("strings_data", "B"),
+    ("state_id", "i"),
+    ("state_name", "I"),
+    ("state_description", "I"),
+    ("state_answer", "I"),
+    ("state_required", "B"),
+    ("vector_name", "I"),
+    ("vector_synonyms", "I"),
+    ("synonyms", "I"),
+    ("step_from", "i"),
+    ("step_to", "i"),
+    ("step_vector", "I"),
+    ("incoming_to", "i"),
+    ("incoming_step", "I"),
+)
+""" секции версии 1: имя и тип элемента (код array) """
+
+_ENTER = -1
+""" step_from точки входа """
+
+_ALIGN = 8
+
+
+class SourceSnapshot(ReadOnlySource):
+    """
+    Сценарий, читаемый напрямую из двоичного снимка (обычно - из mmap).
+    Открытие снимка не зависит от размера сценария: разбирается только
+    заголовок, таблицы используются без копирования.
+    """
+
+    __buffer: memoryview
+    __strings: SynonymStore
+    __tables: dict[str, memoryview]
+
+    __states: dict[int, State]
+    """ созданные состояния (по номеру в таблице) """
+
+    __vectors: dict[int, StoredVector]
+    """ созданные вектора (по номеру в таблице) """
+
+    def __init__(self, buffer) -> None:
+        self.__buffer = memoryview(buffer)
+
+        (
+            magic,
+            version,
+            _,
+            scenario_id,
+            name,
+            description,
+            count,
+        ) = _HEADER.unpack_from(self.__buffer, 0)
+
+        if magic != MAGIC:
+            raise CoreException("Файл не является снимком сценария")
+        if version != VERSION or count != len(_SECTIONS):
+            raise CoreException(f"Неподдерживаемая версия снимка: {version}")
+
+        self.__tables = {}
+        for index, (section, code) in enumerate(_SECTIONS):
+            offset, size = _SECTION.unpack_from(
+                self.__buffer,
+                _HEADER.size + index * _SECTION.size,
+            )
+            self.__tables[section] = _table(
+                self.__buffer[offset : offset + size],
+                code,
+            )
+
+        self.__strings = SynonymStore(
+            self.__tables["strings_offsets"],
+            self.__tables["strings_data"],
+        )
+        self.__states = {}
+        self.__vectors = {}
+
+        super().__init__(
+            None if scenario_id < 0 else ScenarioID(scenario_id),
+            SourceInfo(
+                ProjectName(self.__strings.get(name)),
+                Description(self.__strings.get(description)),
+            ),
+        )
+
+    @staticmethod
+    def open(path: str) -> "SourceSnapshot":
+        """Отобразить файл снимка в память (страницы общие для всех процессов)"""
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return SourceSnapshot(buffer)
+
+    # доступ к таблицам
+
+    def __state(self, index: int) -> State:
+        state = self.__states.get(index)
+        if state is None:
+            tables = self.__tables
+            state = State(
+                StateID(tables["state_id"][index]),
+                StateAttributes(
+                    StateName(self.__strings.get(tables["state_name"][index])),
+                    Description(
+                        self.__strings.get(tables["state_description"][index]),
+                    ),
+                ),
+                PlainTextDescription(
+                    PlainTextAnswer(
+                        self.__strings.get(tables["state_answer"][index]),
+                    ),
+                ),
+                bool(tables["state_required"][index]),
+            )
+            self.__states[index] = state
+
+        return state
+
+    def __state_index(self, id: StateID) -> int | None:
+        ids = self.__tables["state_id"]
+        index = bisect_left(ids, id.value)
+        if index == len(ids) or ids[index] != id.value:
+            return None
+
+        return index
+
+    def __state_by_id(self, id: int) -> State:
+        return self.__state(self.__state_index(StateID(id)))
+
+    def __vector(self, index: int) -> StoredVector:
+        vector = self.__vectors.get(index)
+        if vector is None:
+            bounds = self.__tables["vector_synonyms"]
+            # синонимы сопоставляются прямо по строкам снимка
+            vector = StoredVector(
+                VectorName(
+                    self.__strings.get(self.__tables["vector_name"][index]),
+                ),
+                self.__strings,
+                self.__tables["synonyms"][bounds[index] : bounds[index + 1]],
+            )
+            self.__vectors[index] = vector
+
+        return vector
+
+    def __vector_index(self, name: VectorName) -> int | None:
+        # вектора упорядочены по имени: двоичный поиск по строкам буфера
+        names = self.__tables["vector_name"]
+        low, high = 0, len(names)
+        while low < high:
+            middle = (low + high) // 2
+            value = self.__strings.get(names[middle])
+            if value == name.value:
+                return middle
+            if value < name.value:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def __make_steps(
+        self,
+        indexes: range | list[int],
+        conns: dict[tuple[int, int], Connection],
+        result: list[Step],
+    ):
+        """Создать переходы, объединяя их в связи по паре (из, в)"""
+        tables = self.__tables
+        for index in indexes:
+            from_id = tables["step_from"][index]
+            to_id = tables["step_to"][index]
+
+            conn = conns.get((from_id, to_id))
+            if conn is None:
+                conn = Connection(
+                    None if from_id == _ENTER else self.__state_by_id(from_id),
+                    self.__state_by_id(to_id),
+                    [],
+                )
+                conns[(from_id, to_id)] = conn
+
+            step = Step(self.__vector(tables["step_vector"][index]), conn)
+            conn.steps.append(step)
+            result.append(step)
+
+    def __outgoing(self, id: int) -> range:
+        step_from = self.__tables["step_from"]
+        return range(
+            bisect_left(step_from, id),
+            bisect_right(step_from, id),
+        )
+
+    def __incoming(self, id: int) -> list[int]:
+        incoming_to = self.__tables["incoming_to"]
+        incoming_step = self.__tables["incoming_step"]
+        return [
+            incoming_step[index]
+            for index in range(
+                bisect_left(incoming_to, id),
+                bisect_right(incoming_to, id),
+            )
+        ]
+
+    # Source
+
+    def get_layouts(self) -> str:
+        """-"""
+
+    def save_lay(self, id: StateID, x: float, y: float):
+        """-"""
+
+    def get_states_by_name(self, name: StateName) -> list[State]:
+        result = list[State]()
+        names = self.__tables["state_name"]
+        for index in range(len(names)):
+            if self.__strings.get(names[index]) == name.value:
+                result.append(self.__state(index))
+
+        return result
+
+    def states(self, ids: list[StateID] = None) -> dict[StateID, State]:
+        result = dict[StateID, State]()
+        if ids is None:
+            for index in range(len(self.__tables["state_id"])):
+                state = self.__state(index)
+                result[state.id()] = state
+
+            return result
+
+        for id in ids:
+            index = self.__state_index(id)
+            if index is None:
+                raise NotExists(id, f'Нет состояния с id "{id.value}"')
+            result[id] = self.__state(index)
+
+        return result
+
+    def steps(self, state_id: StateID) -> list[Step]:
+        result = list[Step]()
+        conns = dict[tuple[int, int], Connection]()
+
+        id = state_id.value
+        self.__make_steps(self.__outgoing(id), conns, result)
+        # петли уже учтены среди исходящих
+        incoming = list[int]()
+        for index in self.__incoming(id):
+            if self.__tables["step_from"][index] != id:
+                incoming.append(index)
+        self.__make_steps(incoming, conns, result)
+
+        return result
+
+    def is_enter(self, state: State) -> bool:
+        step_from = self.__tables["step_from"]
+        for index in self.__incoming(state.id().value):
+            if step_from[index] == _ENTER:
+                return True
+
+        return False
+
+    def select_vectors(
+        self,
+        names: list[VectorName] | None = None,
+    ) -> list[InputDescription]:
+        result = list[InputDescription]()
+        if names is None:
+            for index in range(len(self.__tables["vector_name"])):
+                result.append(self.__vector(index))
+
+            return result
+
+        for name in names:
+            index = self.__vector_index(name)
+            if index is not None:
+                result.append(self.__vector(index))
+
+        return result
+
+    def get_vector(self, name: VectorName) -> InputDescription:
+        index = self.__vector_index(name)
+        if index is None:
+            raise NotExists(name, f'Вектор с именем "{name.value}"')
+
+        return self.__vector(index)
+
+    def check_vector_exists(self, name: VectorName) -> bool:
+        return self.__vector_index(name) is not None
+
+    def find_connections_to(self, state_id: StateID) -> list[Connection]:
+        step_from = self.__tables["step_from"]
+        incoming = list[int]()
+        for index in self.__incoming(state_id.value):
+            if step_from[index] != _ENTER:
+                incoming.append(index)
+
+        conns = dict[tuple[int, int], Connection]()
+        self.__make_steps(incoming, conns, [])
+        return list(conns.values())
+
+    def input_usage(self, input: InputDescription) -> list[Connection]:
+        result = list[Connection]()
+        connections = self.get_all_connections()
+
+        for conn in connections["to"].values():
+            for step in conn.steps:
+                if step.input == input:
+                    result.append(conn)
+                    break
+
+        for conn_list in connections["from"].values():
+            for conn in conn_list:
+                for step in conn.steps:
+                    if step.input == input:
+                        result.append(conn)
+                        break
+
+        return result
+
+    def get_enters(self) -> dict[StateID, Connection]:
+        # переходы упорядочены по step_from: точки входа идут первыми
+        conns = dict[tuple[int, int], Connection]()
+        self.__make_steps(self.__outgoing(_ENTER), conns, [])
+        return {StateID(to_id): conn for (_, to_id), conn in conns.items()}
+
+    def get_step_links(
+        self,
+    ) -> list[tuple[StateID | None, StateID, VectorName]]:
+        tables = self.__tables
+        names = dict[int, VectorName]()
+        result = list[tuple[StateID | None, StateID, VectorName]]()
+
+        for index in range(len(tables["step_from"])):
+            from_id = tables["step_from"][index]
+            vector = tables["step_vector"][index]
+            name = names.get(vector)
+            if name is None:
+                name = VectorName(
+                    self.__strings.get(tables["vector_name"][vector]),
+                )
+                names[vector] = name
+
+            result.append(
+                (
+                    None if from_id == _ENTER else StateID(from_id),
+                    StateID(tables["step_to"][index]),
+                    name,
+                ),
+            )
+
+        return result
+
+    def get_all_connections(self) -> dict[str, dict]:
+        conns = dict[tuple[int, int], Connection]()
+        self.__make_steps(
+            range(len(self.__tables["step_from"])),
+            conns,
+            [],
+        )
+
+        result = {
+            "from": dict[StateID, list[Connection]](),
+            "to": dict[StateID, Connection](),
+        }
+        for (from_id, to_id), conn in conns.items():
+            if from_id == _ENTER:
+                result["to"][StateID(to_id)] = conn
+            else:
+                result["from"].setdefault(StateID(from_id), []).append(conn)
+
+        return result
+
+
+def _table(data: memoryview, code: str) -> memoryview:
+    """Представить секцию массивом без копирования"""
+    if code == "B":
+        return data
+
+    if struct.calcsize(code) != 4:
+        raise CoreException("Неподдерживаемая платформа: размер int не 4 байта")
+
+    if sys.byteorder == "little":
+        return data.cast(code)
+
+    # на big-endian платформах секция копируется с перестановкой байт
+    table = array(code)
+    table.frombytes(data)
+    table.byteswap()
+    return memoryview(table)
+
+
+def write_snapshot(src: Source, out: BinaryIO):
+    """Записать снимок сценария из любого хранилища"""
+    strings = dict[str, int]()
+
+    def intern(value: str) -> int:
+        index = strings.get(value)
+        if index is None:
+            index = len(strings)
+            strings[value] = index
+        return index
+
+    info_name = intern(src.info.name.value)
+    info_description = intern(src.info.description.value)
+
+    # состояния
+    states = sorted(src.states().values(), key=lambda state: state.id().value)
+    state_id = array("i")
+    state_name = array("I")
+    state_description = array("I")
+    state_answer = array("I")
+    state_required = array("B")
+    for state in states:
+        state_id.append(state.id().value)
+        state_name.append(intern(state.attributes.name.value))
+        state_description.append(intern(state.attributes.description.value))
+        state_answer.append(intern(state.output().value().as_text()))
+        state_required.append(1 if state.required else 0)
+
+    # вектора и синонимы
+    vectors = sorted(src.select_vectors(), key=lambda v: v.name().value)
+    vector_index = dict[VectorName, int]()
+    vector_name = array("I")
+    vector_synonyms = array("I", [0])
+    synonyms = array("I")
+    for vector in vectors:
+        vector_index[vector.name()] = len(vector_name)
+        vector_name.append(intern(vector.name().value))
+        for index in range(len(vector)):
+            synonyms.append(intern(vector.value(index).value()))
+        vector_synonyms.append(len(synonyms))
+
+    # переходы
+    steps = list[tuple[int, int, int]]()
+    connections = src.get_all_connections()
+    for to_id, conn in connections["to"].items():
+        for step in conn.steps:
+            steps.append(
+                (_ENTER, to_id.value, vector_index[step.input.name()]),
+            )
+    for from_id, conn_list in connections["from"].items():
+        for conn in conn_list:
+            for step in conn.steps:
+                steps.append(
+                    (
+                        from_id.value,
+                        conn.to_state.id().value,
+                        vector_index[step.input.name()],
+                    ),
+                )
+    steps.sort()
+
+    step_from = array("i", [step[0] for step in steps])
+    step_to = array("i", [step[1] for step in steps])
+    step_vector = array("I", [step[2] for step in steps])
+    incoming = sorted(range(len(steps)), key=lambda i: steps[i][1])
+    incoming_to = array("i", [steps[i][1] for i in incoming])
+    incoming_step = array("I", incoming)
+
+    store = SynonymStore.build(strings.keys())
+
+    tables = {
+        "strings_offsets": store.offsets(),
+        "strings_data": store.data(),
+        "state_id": state_id,
+        "state_name": state_name,
+        "state_description": state_description,
+        "state_answer": state_answer,
+        "state_required": state_required,
+        "vector_name": vector_name,
+        "vector_synonyms": vector_synonyms,
+        "synonyms": synonyms,
+        "step_from": step_from,
+        "step_to": step_to,
+        "step_vector": step_vector,
+        "incoming_to": incoming_to,
+        "incoming_step": incoming_step,
+    }
+
+    sections = list[bytes]()
+    for section, code in _SECTIONS:
+        table = tables[section]
+        if isinstance(table, array):
+            if sys.byteorder != "little":
+                table = array(code, table)
+                table.byteswap()
+            sections.append(table.tobytes())
+        else:
+            sections.append(bytes(table))
+
+    scenario_id = -1 if src.id is None else src.id.value
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        0,
+        scenario_id,
+        info_name,
+        info_description,
+        len(_SECTIONS),
+    )
+
+    offset = _HEADER.size + _SECTION.size * len(_SECTIONS)
+    table_of_sections = bytearray()
+    for data in sections:
+        offset += -offset % _ALIGN
+        table_of_sections += _SECTION.pack(offset, len(data))
+        offset += len(data)
+
+    out.write(header)
+    out.write(table_of_sections)
+    written = len(header) + len(table_of_sections)
+    for data in sections:
+        padding = -written % _ALIGN
+        out.write(b"\0" * padding)
+        out.write(data)
+        written += padding + len(data)
+
+
+def load_snapshot(path: str) -> Scenario:
+    """Открыть сценарий из файла снимка"""
+    return Scenario(SourceSnapshot.open(path))
@@ -19,22 +19,33 @@
 # см. <https://www.gnu.org/licenses/>.
 
 
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Callable, Sequence
 from dataclasses import dataclass
 from typing import Optional, Union
 
-import Levenshtein
 from iiconstructor_core.domain import (
     State,
     StepVectorBaseClassificator,
 )
 from iiconstructor_core.domain.exceptions import NotExists, Exists
 from iiconstructor_core.domain.porst import ScenarioInterface
+from iiconstructor_core.domain.primitives import StateID
+from iiconstructor_core.infrastructure.cache import LRUCache
 from iiconstructor_inputvectors.domain import (
     Input,
     StrInput,
     VectorName,
     InputDescription,
 )
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+
+from .normalizer import Normalizer
+from .store import SynonymStore
 
 
 class Synonym(StrInput):
@@ -79,42 +90,409 @@ class LevenshtainVector(InputDescription):
         val_list.append(new_synonym)
         return LevenshtainVector(self.name(), val_list)
 
+
+class StoredVector(LevenshtainVector):
+    """
+    Вектор, синонимы которого лежат в общем наборе строк (SynonymStore).
+    Объекты синонимов создаются только при обращении.
+    """
+
+    __store: SynonymStore
+    __slots: Sequence[int]
+    """ номера синонимов вектора в наборе строк """
+
+    def __init__(
+        self,
+        name: VectorName,
+        store: SynonymStore,
+        slots: Sequence[int],
+    ) -> None:
+        super().__init__(name)
+        self.__store = store
+        self.__slots = slots
+
+    def store(self) -> SynonymStore:
+        return self.__store
+
+    def slots(self) -> Sequence[int]:
+        return self.__slots
+
+    def value(self, index: int = 0) -> Synonym:
+        return Synonym(self.__store.get(self.__slots[index]))
+
+    def __len__(self) -> int:
+        return len(self.__slots)
+
+    def _values(self) -> list[Synonym]:
+        return [self.value(index) for index in range(len(self))]
+
+
+class SynonymsIndex:
+    """
+    Подготовленный к сопоставлению набор синонимов возможных переходов.
+    Синонимы нормализуются и декодируются один раз при построении
+    индекса (синонимы векторов из общего хранилища нормализуются
+    хранилищем и общие для всех индексов) и упорядочиваются по длине.
+    Расстояние Левенштейна не меньше разности длин строк, поэтому
+    сопоставлять имеет смысл только синонимы из окна допустимых длин.
+    """
+
+    choices: list[str]
+    """ нормализованные синонимы (по возрастанию длины) """
+
+    lengths: array
+    """ длины синонимов (по индексу синонима) """
+
+    targets: list[State]
+    """ целевые состояния (по индексу синонима) """
+
+    exact: dict[str, State]
+    """ целевые состояния по точному совпадению с синонимом """
+
+    def __init__(
+        self,
+        possible_inputs: list[tuple[InputDescription, State]],
+        normalize: Callable[[str], str] = str.lower,
+    ) -> None:
+        """
+        @possible_inputs - варианты переходов (вектор, целевое состояние)
+        @normalize - нормализация синонимов (та же, что и для запросов)
+        """
+        entries = list[tuple[str, State]]()
+        self.exact = {}
+
+        for vector, state in possible_inputs:
+            if isinstance(vector, StoredVector):
+                store = vector.store()
+                synonyms = [
+                    store.normalized(slot, normalize)
+                    for slot in vector.slots()
+                ]
+
+            elif isinstance(vector, LevenshtainVector):
+                synonyms = [
+                    normalize(vector.value(index).value())
+                    for index in range(len(vector))
+                ]
+
+            else:
+                continue
+
+            for synonym in synonyms:
+                entries.append((synonym, state))
+                self.exact.setdefault(synonym, state)
+
+        entries.sort(key=lambda entry: len(entry[0]))
+        self.choices = [synonym for synonym, _ in entries]
+        self.targets = [state for _, state in entries]
+        self.lengths = array("I", [len(synonym) for synonym in self.choices])
+
+    def __len__(self) -> int:
+        return len(self.choices)
+
+    def window(self, length: int, max_distance: int) -> tuple[int, int]:
+        """
+        Границы [начало, конец) синонимов, длина которых отличается
+        от length не более чем на max_distance
+        """
+        return (
+            bisect_left(self.lengths, length - max_distance),
+            bisect_right(self.lengths, length + max_distance),
+        )
+
+    def find(self, text: str, max_distance: int) -> State | None:
+        """
+        Найти состояние с ближайшим к text синонимом
+        на расстоянии не более max_distance
+        """
+        # точное совпадение - лучший возможный результат
+        if text in self.exact:
+            return self.exact[text]
+
+        begin, end = self.window(len(text), max_distance)
+        if begin == end:
+            return None
+
+        # кандидаты с расстоянием больше max_distance отбрасываются
+        # без полного вычисления расстояния
+        best = process.extractOne(
+            text,
+            self.choices[begin:end],
+            scorer=Levenshtein.distance,
+            processor=None,
+            score_cutoff=max_distance,
+        )
+
+        if best is None:
+            return None
+
+        _, _, best_index = best
+        return self.targets[begin + best_index]
+
+
+class _BKNode:
+    __slots__ = ("children", "state", "synonym")
+
+    synonym: str
+    state: State
+    children: dict[int, "_BKNode"]
+    """ ключ - расстояние от синонима узла до синонима потомка """
+
+    def __init__(self, synonym: str, state: State) -> None:
+        self.synonym = synonym
+        self.state = state
+        self.children = {}
+
+
+class SynonymsBKTree:
+    """
+    BK-дерево синонимов возможных переходов по метрике Левенштейна.
+    Поиск в радиусе r обходит только поддеревья, ребро к которым
+    отличается от расстояния до узла не более чем на r (неравенство
+    треугольника), а радиус сужается по мере нахождения кандидатов.
+    Используется для большого числа синонимов (все точки входа сценария).
+    """
+
+    __root: _BKNode | None
+    __size: int
+
+    exact: dict[str, State]
+    """ целевые состояния по точному совпадению с синонимом """
+
+    def __init__(
+        self,
+        possible_inputs: list[tuple[InputDescription, State]],
+        normalize: Callable[[str], str] = str.lower,
+    ) -> None:
+        """
+        @possible_inputs - варианты переходов (вектор, целевое состояние)
+        @normalize - нормализация синонимов (та же, что и для запросов)
+        """
+        self.__root = None
+        self.__size = 0
+        self.exact = {}
+
+        for vector, state in possible_inputs:
+            if not isinstance(vector, LevenshtainVector):
+                continue
+
+            for index in range(len(vector)):
+                self.__add(normalize(vector.value(index).value()), state)
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def __add(self, synonym: str, state: State):
+        if synonym in self.exact:
+            return
+
+        self.exact[synonym] = state
+        self.__size += 1
+
+        if self.__root is None:
+            self.__root = _BKNode(synonym, state)
+            return
+
+        node = self.__root
+        while True:
+            distance = Levenshtein.distance(synonym, node.synonym)
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = _BKNode(synonym, state)
+                return
+
+            node = child
+
+    def find(self, text: str, max_distance: int) -> State | None:
+        """
+        Найти состояние с ближайшим к text синонимом
+        на расстоянии не более max_distance
+        """
+        if text in self.exact:
+            return self.exact[text]
+
+        if self.__root is None:
+            return None
+
+        best: State | None = None
+        radius = max_distance
+        nodes = [self.__root]
+
+        while nodes:
+            node = nodes.pop()
+            distance = Levenshtein.distance(text, node.synonym)
+
+            if distance <= radius:
+                best = node.state
+                radius = distance - 1
+                if radius < 0:
+                    break
+
+            for child_distance, child in node.children.items():
+                if abs(child_distance - distance) <= radius:
+                    nodes.append(child)
+
+        return best
+
+
+class _NormalizedInput(StrInput):
+    """Запрос, уже приведённый к виду для сопоставления"""
+
+
 class LevenshtainClassificator(StepVectorBaseClassificator):
-    def __init__(self, project: ScenarioInterface) -> None:
+    """
+    Классификатор по расстоянию Левенштейна до синонимов.
+    Результаты запоминаются (memo) по паре (состояние, нормализованный
+    ввод), включая "запрос не понятен": повторяющиеся запросы ("да",
+    "нет", "помощь") не сопоставляются заново. При любом изменении
+    сценария запомненные результаты сбрасываются
+    """
+
+    __memo: LRUCache | None
+    """ (id состояния, нормализованный ввод) -> следующее состояние """
+
+    __memo_lock: threading.Lock
+
+    __memo_generation: int
+    """ номер сброса: результат, вычисленный до сброса, не запоминается """
+
+    __normalizer: Normalizer
+    """ нормализация синонимов и запросов """
+
+    def __init__(
+        self,
+        project: ScenarioInterface,
+        memo_size: int | None = 4096,
+        normalizer: Normalizer | None = None,
+    ) -> None:
+        """
+        @project - сценарий
+        @memo_size - наибольшее число запомненных результатов (None - не запоминать)
+        @normalizer - нормализация синонимов и запросов (None - по умолчанию)
+        """
+        self.__normalizer = Normalizer() if normalizer is None else normalizer
+        self.__memo = None if memo_size is None else LRUCache(memo_size)
+        self.__memo_lock = threading.Lock()
+        self.__memo_generation = 0
         super().__init__(project)
 
+    def normalize(self, text: str) -> str:
+        """Приведение ввода и синонимов к виду для сопоставления"""
+        return self.__normalizer(text)
+
+    def get_next_state(self, cmd: Input, cur_state_id: StateID) -> State:
+        # запрос нормализуется один раз: calc получает готовый вид
+        cmd = _NormalizedInput(self.normalize(cmd.value()))
+        if self.__memo is None:
+            return super().get_next_state(cmd, cur_state_id)
+
+        key = (cur_state_id, cmd.value())
+        with self.__memo_lock:
+            found, state = self.__memo.get(key)
+            generation = self.__memo_generation
+
+        if found:
+            return state
+
+        state = super().get_next_state(cmd, cur_state_id)
+
+        with self.__memo_lock:
+            if generation == self.__memo_generation:
+                self.__memo.put(key, state)
+
+        return state
+
+    def memo_stats(self) -> dict | None:
+        """Статистика запомненных результатов (None - не запоминаются)"""
+        if self.__memo is None:
+            return None
+
+        with self.__memo_lock:
+            stats = self.__memo.stats()
+
+        requests = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / requests if requests else 0.0
+        return stats
+
+    def memo_memory(self) -> int:
+        """
+        Оценка памяти запомненных результатов, байт: ключи и строки
+        запросов (состояния учтены в индексе сценария)
+        """
+        if self.__memo is None:
+            return 0
+
+        with self.__memo_lock:
+            keys = self.__memo.keys()
+
+        size = sys.getsizeof(self.__memo)
+        for key in keys:
+            size += sys.getsizeof(key) + sys.getsizeof(key[1])
+
+        return size
+
+    def __reset_memo(self):
+        if self.__memo is None:
+            return
+
+        with self.__memo_lock:
+            self.__memo_generation += 1
+            self.__memo.clear()
+
+    # результат зависит от переходов и точек входа, поэтому
+    # любое изменение сценария сбрасывает все запомненные результаты
+
+    def on_state_changed(self, state_id: StateID):
+        super().on_state_changed(state_id)
+        self.__reset_memo()
+
+    def on_steps_changed(self, state_id: StateID):
+        super().on_steps_changed(state_id)
+        self.__reset_memo()
+
+    def on_enters_changed(self):
+        super().on_enters_changed()
+        self.__reset_memo()
+
+    def on_vector_changed(self, name: VectorName):
+        super().on_vector_changed(name)
+        self.__reset_memo()
+
+    def prepare(
+        self,
+        possible_inputs: list[tuple[InputDescription, State]],
+    ) -> SynonymsIndex:
+        return SynonymsIndex(possible_inputs, self.__normalizer)
+
+    def prepare_enters(
+        self,
+        possible_inputs: list[tuple[InputDescription, State]],
+    ) -> SynonymsBKTree:
+        return SynonymsBKTree(possible_inputs, self.__normalizer)
+
+    @staticmethod
+    def max_distance(text: str) -> int:
+        """Наибольшее допустимое расстояние (меньше половины длины ввода)"""
+        return (len(text) - 1) // 2
+
     def calc(
         self,
         cur_input: Input,
-        possible_inputs: dict[str, State],
+        possible_inputs: SynonymsIndex | SynonymsBKTree,
     ) -> State | None:
         if len(possible_inputs) == 0:
             raise NotExists(cur_input, "Подходящий вектор")
 
-        best_score = 0
-        best: State | None = None
+        text = cur_input.value()
+        if not isinstance(cur_input, _NormalizedInput):
+            text = self.normalize(text)
 
-        for key, val in possible_inputs.items():
-            vector = self._StepVectorBaseClassificator__project.get_vector(
-                VectorName(key),
-            )
-            if not isinstance(vector, LevenshtainVector):
-                continue
+        cutoff = self.max_distance(text)
+        if cutoff < 0:
+            raise NotExists(cur_input, "Подходящий вектор")
 
-            best_distance: int
-            for index in range(len(vector)):
-                synonym = vector.value(index)
-                distance = Levenshtein.distance(
-                    synonym.value().lower(),
-                    cur_input.value().lower(),
-                )
-
-                if best is None or distance < best_distance:
-                    best_distance = distance
-                    best = val
-                    continue
-
-        if best_distance >= len(cur_input.value()) / 2:
+        best = possible_inputs.find(text, cutoff)
+        if best is None:
             raise NotExists(cur_input, "Подходящий вектор")
 
         return best
@@ -0,0 +1,66 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+import re
+from dataclasses import dataclass
+
+_PUNCTUATION = re.compile(r"[^\w\s]|_")
+""" знаки препинания и прочие символы, не входящие в слова """
+
+
+@dataclass(frozen=True)
+class Normalizer:
+    """
+    Приведение текста к виду для сопоставления.
+    Применяется один раз к каждому синониму при построении индекса
+    и один раз к каждому запросу, а не к каждой паре при сравнении
+    """
+
+    casefold: bool = True
+    """ без учёта регистра """
+
+    yo: bool = True
+    """ "ё" равна "е" """
+
+    punctuation: bool = True
+    """ знаки препинания заменяются пробелами (пробелы схлопываются всегда) """
+
+    stop_words: frozenset[str] = frozenset()
+    """ слова, не влияющие на смысл (в нормализованном виде) """
+
+    def __call__(self, text: str) -> str:
+        if self.casefold:
+            text = text.casefold()
+
+        if self.yo:
+            text = text.replace("ё", "е").replace("Ё", "Е")
+
+        if self.punctuation:
+            text = _PUNCTUATION.sub(" ", text)
+
+        words = text.split()
+        if self.stop_words:
+            # фраза только из стоп-слов остаётся как есть
+            meaningful = [word for word in words if word not in self.stop_words]
+            if len(meaningful) > 0:
+                words = meaningful
+
+        return " ".join(words)
@@ -0,0 +1,89 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+from array import array
+from collections.abc import Callable, Hashable, Iterable, Sequence
+
+
+class SynonymStore:
+    """
+    Неизменяемый набор строк в одном буфере UTF-8 с таблицей смещений.
+    Строка i - это байты data[offsets[i]:offsets[i + 1]].
+    Буфер может быть отображённым в память файлом (снимок сценария),
+    тогда он разделяется всеми процессами движка; объекты строк
+    создаются только на время обращения.
+    """
+
+    __offsets: Sequence[int]
+    """ смещения строк в буфере (на одно больше числа строк) """
+
+    __data: memoryview
+    """ строки в UTF-8 подряд """
+
+    __normalized: dict[Hashable, dict[int, str]]
+    """ нормализованные строки по номеру (по функции нормализации) """
+
+    def __init__(self, offsets: Sequence[int], data) -> None:
+        self.__offsets = offsets
+        self.__data = memoryview(data)
+        self.__normalized = {}
+
+    @staticmethod
+    def build(values: Iterable[str]) -> "SynonymStore":
+        """Упаковать строки в новый буфер"""
+        offsets = array("I", [0])
+        data = bytearray()
+        for value in values:
+            data += value.encode("utf-8")
+            offsets.append(len(data))
+
+        return SynonymStore(offsets, bytes(data))
+
+    def __len__(self) -> int:
+        return len(self.__offsets) - 1
+
+    def get(self, index: int) -> str:
+        begin = self.__offsets[index]
+        end = self.__offsets[index + 1]
+        return str(self.__data[begin:end], "utf-8")
+
+    def normalized(self, index: int, normalize: Callable[[str], str]) -> str:
+        """
+        Строка index, приведённая normalize.
+        Нормализуются только запрошенные строки (синонимы векторов),
+        каждая один раз для каждой функции нормализации; результат
+        используется всеми индексами, которые ссылаются на этот набор
+        """
+        values = self.__normalized.get(normalize)
+        if values is None:
+            values = self.__normalized.setdefault(normalize, {})
+
+        value = values.get(index)
+        if value is None:
+            value = values[index] = normalize(self.get(index))
+
+        return value
+
+    def offsets(self) -> Sequence[int]:
+        return self.__offsets
+
+    def data(self) -> memoryview:
+        return self.__data
@@ -19,7 +19,10 @@
 # см. <https://www.gnu.org/licenses/>.
 
 
-from collections.abc import Sequence
+import threading
+from collections.abc import Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from typing import Any
 
 import pymysql
 from iiconstructor_core.domain import (
@@ -32,6 +35,12 @@ from iiconstructor_core.domain import (
     Step,
 )
 from iiconstructor_core.domain.exceptions import CoreException, NotExists
+from iiconstructor_core.infrastructure.dump import (
+    ScenarioDump,
+    ScenarioItem,
+    validated_items,
+)
+from iiconstructor_core.infrastructure.pool import ConnectionPool
 from iiconstructor_answers.plaintext import (
     PlainTextAnswer,
     PlainTextDescription,
@@ -51,59 +60,233 @@ from iiconstructor_core.domain.primitives import (
 )
 from iiconstructor_levenshtain import LevenshtainVector, Synonym
 
+_INSERT_VECTOR = "INSERT INTO `vectors` (`name`, `type`, `project_id`) VALUES (%s, %s, %s)"
+_INSERT_SYNONYM = "INSERT INTO `synonyms` (`group_name`, `value`, `project_id`) VALUES (%s, %s, %s)"
+_INSERT_STEP = "INSERT INTO `steps` (`project_id`, `from_state_id`, `to_state_id`, `vector_name`) VALUES (%s, %s, %s, %s)"
+
+_DEFERRED = (_INSERT_VECTOR, _INSERT_SYNONYM, _INSERT_STEP)
+""" вставки, откладываемые до конца пакета (в порядке внешних ключей) """
+
 
 class SourceMySQL(Source):
-    __db_connection: pymysql.Connection
+    __pool: ConnectionPool
+    """ пул подключений, подключение берётся на время одной операции """
 
-    def __init__(self, conn: pymysql.Connection, id: ScenarioID) -> None:
-        if not conn.open:
-            raise CoreException(
-                "подключение не открыто",
-                "Не удалось открыть ",
-            )
+    __transaction: threading.local
+    """
+    пакет изменений текущего потока: подключение, глубина вложенности,
+    отложенные вставки и то, что о них известно без запросов к БД
+    """
 
-        self.__db_connection = conn
+    def __init__(self, pool: ConnectionPool, id: ScenarioID) -> None:
+        self.__pool = pool
+        self.__transaction = threading.local()
 
-        cur = conn.cursor()
-        cur.execute(
+        rows = self.__query(
             "SELECT name, description FROM projects WHERE id=%s",
             (id.value,),
         )
-        conn.commit()
-        name, descr = cur.fetchone()
+        if not rows:
+            raise NotExists(id, f'Сценарий с id "{id.value}"')
+        name, descr = rows[0]
 
         info = SourceInfo(ProjectName(name), Description(descr))
         super().__init__(id, info)
 
-    @staticmethod
-    def __find_vector(
-        list: list[InputDescription],
-        name: VectorName,
-    ) -> InputDescription:
-        for vector in list:
-            if vector.name() == name:
-                return vector
+    def begin(self):
+        tx = self.__transaction
+        if getattr(tx, "depth", 0) == 0:
+            # подключение удерживается потоком до конца пакета
+            tx.context = self.__pool.connection()
+            tx.conn = tx.context.__enter__()
+            tx.depth = 0
+            tx.changed = False
+            tx.pending = {query: list[tuple]() for query in _DEFERRED}
+            # вектора, известные без запроса (добавленные или прочитанные)
+            tx.vectors = dict[VectorName, InputDescription]()
+            # вектора с отложенными синонимами, которых нет в tx.vectors
+            tx.dirty = set[VectorName]()
+            # состояния, известные без запроса (созданные или прочитанные)
+            tx.states = dict[StateID, State]()
+            # состояния с отложенной вставкой точки входа
+            tx.enters = set[StateID]()
+
+        tx.depth += 1
+
+    def commit(self):
+        self.__finish(True)
+
+    def rollback(self):
+        self.__finish(False)
+
+    def __finish(self, save: bool):
+        tx = self.__transaction
+        if getattr(tx, "depth", 0) == 0:
+            raise CoreException("Пакет изменений не начат")
+
+        tx.depth -= 1
+        if tx.depth > 0:
+            return
+
+        context, conn, pending = tx.context, tx.conn, tx.pending
+        tx.context = tx.conn = tx.pending = None
+        tx.vectors, tx.dirty, tx.states, tx.enters = {}, set(), {}, set()
+        try:
+            if save:
+                try:
+                    self.__write_pending(conn, pending)
+                    if tx.changed:
+                        # версия увеличивается один раз на пакет изменений
+                        conn.cursor().execute(
+                            "UPDATE `projects` SET `version` = `version` + 1 WHERE `id` = %s",
+                            (self.id.value,),
+                        )
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+            else:
+                conn.rollback()
+        finally:
+            context.__exit__(None, None, None)
+
+    def __in_transaction(self) -> bool:
+        return getattr(self.__transaction, "depth", 0) > 0
+
+    @contextmanager
+    def __unit(self) -> Iterator[None]:
+        """несколько запросов одной транзакцией"""
+        self.begin()
+        try:
+            yield
+        except BaseException:
+            self.rollback()
+            raise
+
+        self.commit()
+
+    @contextmanager
+    def __change(self) -> Iterator[None]:
+        """изменение сценария: выполняется в транзакции и увеличивает версию"""
+        with self.__unit():
+            yield
+            self.__transaction.changed = True
 
-        assert False
+    @staticmethod
+    def __write_pending(conn, pending: dict[str, list[tuple]]):
+        """отложенные вставки: по одному executemany на таблицу"""
+        cur = conn.cursor()
+        for query, rows in pending.items():
+            if rows:
+                cur.executemany(query, rows)
+                rows.clear()
+
+    def __flush(self):
+        """
+        Выполнить отложенные вставки. Вызывается перед любым запросом,
+        результат которого от них зависит
+        """
+        if not self.__in_transaction():
+            return
+
+        tx = self.__transaction
+        self.__write_pending(tx.conn, tx.pending)
+        tx.vectors.clear()
+        tx.dirty.clear()
+        tx.states.clear()
+        tx.enters.clear()
+
+    def __defer(self, query: str, rows: Sequence[tuple]):
+        """отложить вставку строк до конца пакета (только внутри __change)"""
+        self.__transaction.pending[query].extend(rows)
 
     def __do(self, query: str, data: Sequence = ()):
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        cur.execute(query, data)
-        conn.commit()
+        self.__flush()
+        with self.__pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, data)
+            if not self.__in_transaction():
+                conn.commit()
+
+    def __query(
+        self,
+        query: str,
+        data: Sequence = (),
+        flush: bool = True,
+    ) -> list[tuple]:
+        """
+        @flush - выполнить отложенные вставки перед запросом (False - для
+        запросов к таблицам, вставка в которые не откладывается)
+        """
+        if flush:
+            self.__flush()
+
+        with self.__pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, data)
+            if not self.__in_transaction():
+                conn.commit()
+            return cur.fetchall()
+
+    def __load_vectors(
+        self,
+        names: list[VectorName] | None = None,
+    ) -> dict[VectorName, InputDescription]:
+        """
+        Вектора вместе с синонимами (одним запросом)
+        @names - имена векторов (None - все вектора сценария)
+        """
+        cached = dict[VectorName, InputDescription]()
+        if names is not None and self.__in_transaction():
+            # вектора, добавленные или прочитанные в пакете, известны без запроса
+            tx = self.__transaction
+            cached = {
+                name: tx.vectors[name] for name in names if name in tx.vectors
+            }
+            names = [name for name in names if name not in cached]
+            if not tx.dirty.isdisjoint(names):
+                self.__flush()
+            if not names:
+                return cached
+
+        query = "SELECT `vectors`.`name`, `synonyms`.`value` FROM `vectors` LEFT JOIN `synonyms` ON `synonyms`.`project_id` = `vectors`.`project_id` AND `synonyms`.`group_name` = `vectors`.`name` WHERE `vectors`.`project_id` = %s"
+        data = [self.id.value]
+        if names is not None:
+            query += f' AND `vectors`.`name` IN ({", ".join(["%s"] * len(names))})'
+            for name in names:
+                data.append(name.value)
+
+        groups = dict[VectorName, list[Synonym]]()
+        for _name, _value in self.__query(query, data, flush=names is None):
+            synonyms_g = groups.setdefault(VectorName(_name), [])
+            if _value is not None:
+                synonyms_g.append(Synonym(_value))
+
+        result = dict[VectorName, InputDescription]()
+        for _name, synonyms_g in groups.items():
+            result[_name] = LevenshtainVector(_name, synonyms_g)
+
+        if names is not None and self.__in_transaction():
+            self.__transaction.vectors.update(result)
+
+        result.update(cached)
+        return result
+
+    def version(self) -> int:
+        ((version,),) = self.__query(
+            "SELECT `version` FROM `projects` WHERE `id` = %s",
+            (self.id.value,),
+            flush=False,
+        )
+        return version
 
     def get_layouts(self) -> str:
         query = (
             f"SELECT id, x, y FROM `states` WHERE project_id = {self.id.value}"
         )
 
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        cur.execute(query)
-        conn.commit()
-
         result = list[str]()
-        for id, x, y in cur:
+        for id, x, y in self.__query(query, flush=False):
             result.append(f"{id}: x={x}, y={y};")
 
         return "\n".join(result)
@@ -115,21 +298,20 @@ class SourceMySQL(Source):
         )
 
     def delete_state(self, state_id: StateID):
-        self.__do(
-            "DELETE FROM `states` WHERE `project_id` = %s AND `id` = %s",
-            (self.id.value, state_id.value),
-        )
+        with self.__change():
+            self.__do(
+                "DELETE FROM `states` WHERE `project_id` = %s AND `id` = %s",
+                (self.id.value, state_id.value),
+            )
 
     def get_states_by_name(self, name: StateName) -> list[State]:
         query = f"SELECT id, IFNULL( name, id ) AS name, descr, answer, required FROM `states` WHERE project_id = {self.id.value} AND name = '{name.value}'"
 
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        cur.execute(query)
-        conn.commit()
-
         result = list[State]()
-        for _id, _name, _descr, _answer, _required in cur:
+        for _id, _name, _descr, _answer, _required in self.__query(
+            query,
+            flush=False,
+        ):
             result.append(
                 State(
                     StateID(_id),
@@ -148,24 +330,23 @@ class SourceMySQL(Source):
         if not ids and ids is not None:
             return dict[StateID, State]()
 
-        query = f"SELECT id, IFNULL( name, id ) AS name, descr, answer, required FROM `states` WHERE project_id = {self.id.value}"
+        query = "SELECT id, IFNULL( name, id ) AS name, descr, answer, required FROM `states` WHERE project_id = %s"
+        data = [self.id.value]
         if ids is not None:
-            where_append = []
-            for id in ids:
-                if id is None:
-                    where_append.append("`id` = NULL")
-                else:
-                    where_append.append(f"`id` = {id.value}")
+            # id = NULL ничему не соответствует
+            _ids = [id.value for id in ids if id is not None]
+            if not _ids:
+                return dict[StateID, State]()
 
-            query += f' AND ( {" OR ".join(where_append)} )'
-
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        cur.execute(query)
-        conn.commit()
+            query += f' AND `id` IN ({", ".join(["%s"] * len(_ids))})'
+            data.extend(_ids)
 
         result = dict[StateID, State]()
-        for _id, _name, _descr, _answer, _required in cur:
+        for _id, _name, _descr, _answer, _required in self.__query(
+            query,
+            data,
+            flush=False,
+        ):
             s_id = StateID(_id)
             result[s_id] = State(
                 s_id,
@@ -180,109 +361,79 @@ class SourceMySQL(Source):
         return result
 
     def steps(self, state_id: StateID) -> list[Step]:
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        cur.execute(
+        db_result = self.__query(
             "SELECT `from_state_id`, `to_state_id`, `vector_name` FROM `steps` WHERE `project_id` = %s AND (`to_state_id` = %s OR `from_state_id` = %s)",
             (self.id.value, state_id.value, state_id.value),
         )
-        conn.commit()
-        db_result = cur.fetchall()
-
-        pairs_to = list[StateID]()
-        pairs_from = list[StateID]()
-
-        # получить все состояния и вектора
-        s_id_list = list[StateID]()
-        vector_names_list = list[VectorName]()
 
+        # получить все состояния (вместе с state_mid) и вектора
+        s_ids = {state_id}
+        vector_names = set[VectorName]()
         for _from_state, _to_state, _vector_name in db_result:
-            __vector_name = VectorName(_vector_name)
-            if __vector_name not in vector_names_list:
-                vector_names_list.append(__vector_name)
-
-            __to_state_id: StateID = StateID(_to_state)
-            if __to_state_id not in s_id_list:
-                s_id_list.append(__to_state_id)
-
-            __from_state_id: StateID | None = None
+            vector_names.add(VectorName(_vector_name))
+            s_ids.add(StateID(_to_state))
             if _from_state is not None:
-                __from_state_id = StateID(_from_state)
-                if __from_state_id not in s_id_list:
-                    s_id_list.append(__from_state_id)
-
-            if __from_state_id == state_id and __to_state_id not in pairs_from:
-                pairs_from.append(__to_state_id)
-
-            if __to_state_id == state_id and __from_state_id not in pairs_to:
-                pairs_to.append(__from_state_id)
-
-        f_states = self.states(s_id_list)
-        f_vectors = self.select_vectors(vector_names_list)
+                s_ids.add(StateID(_from_state))
 
-        # получить state_mid
-        state_mid = self.states([state_id])[state_id]
+        f_states = self.states(list(s_ids))
+        f_vectors = self.__load_vectors(list(vector_names))
+        state_mid = f_states[state_id]
 
         conns = {
             "from": dict[StateID, Connection](),
-            "to": dict[StateID, Connection](),
+            "to": dict[StateID | None, Connection](),
         }
-        # сформировать все Connection
-        for pair in pairs_to:
-            if pair is None:
-                conns["to"][None] = Connection(None, state_mid, [])
-            else:
-                conns["to"][pair] = Connection(f_states[pair], state_mid, [])
 
-        for pair in pairs_from:
-            conns["from"][pair] = Connection(state_mid, f_states[pair], [])
-
-        # заполнить все Connection переходами и сформировать результат
+        # сформировать все Connection, заполнить их переходами
+        # и сформировать результат за один проход
         result = list[Step]()
         for _from_state, _to_state, _vector_name in db_result:
-            d_key = None
-            if StateID(_from_state) == state_id:
-                d_key = "from"
-
+            __state_id: StateID | None
             if StateID(_to_state) == state_id:
                 d_key = "to"
+                __state_id = (
+                    None if _from_state is None else StateID(_from_state)
+                )
+            else:
+                d_key = "from"
+                __state_id = StateID(_to_state)
 
-            assert d_key is not None
+            _conn = conns[d_key].get(__state_id)
+            if _conn is None:
+                if d_key == "from":
+                    _conn = Connection(state_mid, f_states[__state_id], [])
+                elif __state_id is None:
+                    _conn = Connection(None, state_mid, [])
+                else:
+                    _conn = Connection(f_states[__state_id], state_mid, [])
 
-            __state_id: StateID | None = None
-            if d_key == "from":
-                __state_id = StateID(_to_state)
-            elif _from_state is not None:
-                __state_id = StateID(_from_state)
+                conns[d_key][__state_id] = _conn
 
-            _conn = conns[d_key][__state_id]
-            step = Step(
-                self.__find_vector(f_vectors, VectorName(_vector_name)),
-                _conn,
-            )
+            step = Step(f_vectors[VectorName(_vector_name)], _conn)
             _conn.steps.append(step)
             result.append(step)
 
         return result
 
     def is_enter(self, state: State) -> bool:
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        # query = f"SELECT EXISTS( SELECT 1 FROM `steps` WHERE `project_id` = {self.id.value} AND ( `from_state_id` IS NULL AND `to_state_id` = {state.id().value} ))"
-        # cur.execute(query)
-        cur.execute(
+        # отложенные вставки только добавляют точки входа,
+        # поэтому остальные проверяются по БД без их выполнения
+        if self.__in_transaction() and state.id() in self.__transaction.enters:
+            return True
+
+        ((result,),) = self.__query(
             "SELECT EXISTS( SELECT 1 FROM `steps` WHERE `project_id` = %s AND ( `from_state_id` IS NULL AND `to_state_id` = %s ))",
             (self.id.value, state.id().value),
+            flush=False,
         )
-        conn.commit()
-        (result,) = cur.fetchone()
         return result
 
     def set_answer(self, state_id: StateID, data: PlainTextDescription):
-        self.__do(
-            "UPDATE `states` SET `answer` = %s WHERE `states`.`project_id` = %s AND `states`.`id` = %s",
-            (data.value().as_text(), self.id.value, state_id.value),
-        )
+        with self.__change():
+            self.__do(
+                "UPDATE `states` SET `answer` = %s WHERE `states`.`project_id` = %s AND `states`.`id` = %s",
+                (data.value().as_text(), self.id.value, state_id.value),
+            )
 
     def select_vectors(
         self,
@@ -291,113 +442,89 @@ class SourceMySQL(Source):
         if not names and names is not None:
             return list["InputDescription"]()
 
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        result = list[InputDescription]()
-
-        if names is not None:
-            _names = names
-        else:
-            _names = list[VectorName]()
-
-            cur.execute(
-                "SELECT DISTINCT `name` FROM `vectors` WHERE `project_id` = %s",
-                (self.id.value,),
-            )
-            conn.commit()
-
-            for (val,) in cur:
-                _names.append(VectorName(val))
-
-        for _name in _names:
-            if not self.check_vector_exists(_name):
-                continue
-
-            cur.execute(
-                "SELECT `value` FROM `synonyms` WHERE `project_id` = %s AND `group_name` = %s",
-                (self.id.value, _name.value),
-            )
-            conn.commit()
+        if names is None:
+            return list(self.__load_vectors().values())
 
-            synonyms_g = list[Synonym]()
-            for (val,) in cur:
-                synonyms_g.append(Synonym(val))
+        f_vectors = self.__load_vectors(names)
 
-            result.append(LevenshtainVector(_name, synonyms_g))
+        # несуществующие вектора пропускаются
+        result = list[InputDescription]()
+        for _name in names:
+            if _name in f_vectors.keys():
+                result.append(f_vectors[_name])
 
         return result
 
     def get_vector(self, name: VectorName) -> InputDescription:
-        n_val = name.value
-
-        if not self.check_vector_exists(name):
+        f_vectors = self.__load_vectors([name])
+        if name not in f_vectors.keys():
             raise NotExists(name, f'Вектор с именем "{name.value}"')
 
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT `value` FROM `synonyms` WHERE `project_id` = %s AND `group_name` = %s",
-            (self.id.value, n_val),
-        )
-        conn.commit()
-
-        synonyms_g = list[Synonym]()
-        for (val,) in cur:
-            synonyms_g.append(Synonym(val))
-
-        return LevenshtainVector(name, synonyms_g)
+        return f_vectors[name]
 
     def add_vector(self, input: InputDescription):
         _type = "synonyms_set"
         _name = input.name().value
 
-        # создать группу синонимов (вектор)
-        self.__do(
-            "INSERT INTO `vectors` (`name`, `type`, `project_id`) VALUES (%s, %s, %s)",
-            (_name, _type, self.id.value),
-        )
-
-        # создать синонимы
-        for synonym in input.synonyms.synonyms:
-            self.__do(
-                "INSERT INTO `synonyms` (`group_name`, `value`, `project_id`) VALUES (%s, %s, %s)",
-                (_name, synonym.value, self.id.value),
+        synonyms = list[tuple]()
+        for index in range(len(input)):
+            synonyms.append((_name, input.value(index).value(), self.id.value))
+
+        with self.__change():
+            # вектор и синонимы вставляются при завершении пакета
+            self.__defer(_INSERT_VECTOR, [(_name, _type, self.id.value)])
+            self.__defer(_INSERT_SYNONYM, synonyms)
+            self.__transaction.vectors[VectorName(_name)] = LevenshtainVector(
+                VectorName(_name),
+                [Synonym(value) for _, value, _ in synonyms],
             )
 
     def remove_vector(self, name: VectorName):
-        self.__do(
-            "DELETE FROM `vectors` WHERE `vectors`.`project_id` = %s AND `vectors`.`name` = %s",
-            (self.id.value, name.value),
-        )
+        with self.__change():
+            self.__do(
+                "DELETE FROM `vectors` WHERE `vectors`.`project_id` = %s AND `vectors`.`name` = %s",
+                (self.id.value, name.value),
+            )
 
     def update_vector(self, name: VectorName, input: InputDescription):
         if not self.check_vector_exists(name):
             raise NotExists(name, "Вектор")
         
-        self.__do(
-            "DELETE FROM `synonyms` WHERE `synonyms`.`project_id` = ? AND `synonyms`.`group_name` = ?",
-            (self.id.value, name.value),
-        )
-
         _name = input.name().value
+        synonyms = list[tuple]()
         for index in range(len(input)):
+            synonyms.append((_name, input.value(index).value(), self.id.value))
+
+        with self.__change():
             self.__do(
-                "INSERT INTO `synonyms` (`group_name`, `value`, `project_id`) VALUES (?, ?, ?)",
-                (_name, input.value(index).value(), self.id.value),
+                "DELETE FROM `synonyms` WHERE `synonyms`.`project_id` = %s AND `synonyms`.`group_name` = %s",
+                (self.id.value, name.value),
             )
+            self.__defer(_INSERT_SYNONYM, synonyms)
+            if VectorName(_name) == name:
+                self.__transaction.vectors[name] = LevenshtainVector(
+                    name,
+                    [Synonym(value) for _, value, _ in synonyms],
+                )
+            else:
+                self.__transaction.dirty.add(VectorName(_name))
 
     def check_vector_exists(self, name: VectorName) -> bool:
         if name is None:
             return False
 
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        cur.execute(
+        if self.__in_transaction():
+            tx = self.__transaction
+            if name in tx.vectors:
+                return True
+            if name in tx.dirty:
+                self.__flush()
+
+        ((answer,),) = self.__query(
             "SELECT EXISTS(SELECT 1 FROM `vectors` WHERE `project_id` = %s AND `name` = %s) as ans",
             (self.id.value, name.value),
+            flush=False,
         )
-        conn.commit()
-        (answer,) = cur.fetchone()
         return answer
 
     def create_state(
@@ -406,95 +533,70 @@ class SourceMySQL(Source):
         output: PlainTextDescription,
         required: bool = False,
     ) -> State:
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-
-        _proj_id = self.id.value
-        _name = "DEFAULT"
-        if attributes.name is not None:
-            _name = f"'{attributes.name.value}'"
-        _descr = "DEFAULT"
-        if attributes.description is not None:
-            _descr = f"'{attributes.description.value}'"
-        _answ = "DEFAULT"
-        if (
-            output is not None
-            and output.value() is not None
-        ):
-            _answ = f"'{output.value().as_text()}'"
-
-        query = f"INSERT INTO `states` (`project_id`, `name`, `descr`, `answer`, `required`) VALUES (%s, {_name}, {_descr}, {_answ}, %s) RETURNING `id`, `answer`, `name`, `descr`, `required`"
-        cur.execute(query, (_proj_id, required))
-        conn.commit()
-        id, answer, name, descr, required = cur.fetchone()
-        return State(
-            StateID(id),
-            StateAttributes(
-                StateName(name),
-                Description(descr),
-            ),
-            PlainTextDescription(PlainTextAnswer(answer)),
-            required,
-        )
+        with self.__change():
+            _proj_id = self.id.value
+            _name = "DEFAULT"
+            if attributes.name is not None:
+                _name = f"'{attributes.name.value}'"
+            _descr = "DEFAULT"
+            if attributes.description is not None:
+                _descr = f"'{attributes.description.value}'"
+            _answ = "DEFAULT"
+            if (
+                output is not None
+                and output.value() is not None
+            ):
+                _answ = f"'{output.value().as_text()}'"
+
+            query = f"INSERT INTO `states` (`project_id`, `name`, `descr`, `answer`, `required`) VALUES (%s, {_name}, {_descr}, {_answ}, %s) RETURNING `id`, `answer`, `name`, `descr`, `required`"
+            # id нужен сразу, поэтому вставка состояния не откладывается
+            ((id, answer, name, descr, required),) = self.__query(
+                query,
+                (_proj_id, required),
+                flush=False,
+            )
+            state = State(
+                StateID(id),
+                StateAttributes(
+                    StateName(name),
+                    Description(descr),
+                ),
+                PlainTextDescription(PlainTextAnswer(answer)),
+                required,
+            )
+            self.__transaction.states[state.id()] = state
+            return state
 
     def find_connections_to(self, state_id: StateID) -> list[Connection]:
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT `from_state_id`, `to_state_id`, `vector_name` FROM `steps` WHERE `project_id` = %s AND (`to_state_id` = %s)",
+        db_result = self.__query(
+            "SELECT `from_state_id`, `to_state_id`, `vector_name` FROM `steps` WHERE `project_id` = %s AND `to_state_id` = %s AND NOT `from_state_id` IS NULL",
             (self.id.value, state_id.value),
         )
-        conn.commit()
-        db_result = cur.fetchall()
-
-        pairs_from: list[StateID] = []
-
-        # получить все состояния и вектора
-        s_id_list: list[StateID] = []
-        vector_names_list: list[VectorName] = []
 
+        # получить все состояния (вместе с state_mid) и вектора
+        s_ids = {state_id}
+        vector_names = set[VectorName]()
         for _from_state, _to_state, _vector_name in db_result:
-            __vector_name = VectorName(_vector_name)
-            if __vector_name not in vector_names_list:
-                vector_names_list.append(__vector_name)
-
-            if _from_state is not None:
-                __from_state_id = StateID(_from_state)
-                if __from_state_id not in s_id_list:
-                    s_id_list.append(__from_state_id)
-            else:
-                __from_state_id = None
-
-            if __from_state_id not in pairs_from:
-                pairs_from.append(__from_state_id)
+            vector_names.add(VectorName(_vector_name))
+            s_ids.add(StateID(_from_state))
 
-        f_states = self.states(s_id_list)
-        f_vectors = self.select_vectors(vector_names_list)
-
-        # получить state_mid
-        state_mid = self.states([state_id])[state_id]
+        f_states = self.states(list(s_ids))
+        f_vectors = self.__load_vectors(list(vector_names))
+        state_mid = f_states[state_id]
 
+        # сформировать все Connection и заполнить их переходами
         conns = dict[StateID, Connection]()
-        # сформировать все Connection
-        for pair in pairs_from:
-            if pair is not None:
-                conns[pair] = Connection(f_states[pair], state_mid, [])
-
-        # заполнить все Connection переходами и сформировать результат
         for _from_state, _to_state, _vector_name in db_result:
-            if _from_state is not None:
-                _conn = conns[StateID(_from_state)]
-                step = Step(
-                    self.__find_vector(f_vectors, VectorName(_vector_name)),
-                    _conn,
-                )
-                _conn.steps.append(step)
+            __from_state_id = StateID(_from_state)
+            _conn = conns.get(__from_state_id)
+            if _conn is None:
+                _conn = Connection(f_states[__from_state_id], state_mid, [])
+                conns[__from_state_id] = _conn
 
-        result = list[Connection]()
-        for _conn in conns.values():
-            result.append(_conn)
+            step = Step(f_vectors[VectorName(_vector_name)], _conn)
+            _conn.steps.append(step)
 
-        return result
+        return list(conns.values())
 
     def input_usage(self, input: InputDescription) -> list[Connection]:
         result = list[Connection]()
@@ -524,35 +626,40 @@ class SourceMySQL(Source):
         to_state: StateID,
         input_name: VectorName,
     ) -> Step:
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO `steps` (`project_id`, `from_state_id`, `to_state_id`, `vector_name`) VALUES (%s, %s, %s, %s) RETURNING `from_state_id`, `to_state_id`, `vector_name`",
-            (
-                self.id.value,
-                None if from_state is None else from_state.value,
-                to_state.value,
-                input_name.value,
-            ),
-        )
-        conn.commit()
-
-        from_id, to_id, in_name = cur.fetchone()
-        __from_id = None if from_id is None else StateID(from_id)
-        __to_id = StateID(to_id)
-        states = self.states([__from_id, __to_id])
-        state_from = (
-            states[StateID(from_id)]
-            if StateID(from_id) in states.keys()
-            else None
-        )
-        state_to = states[StateID(to_id)]
-        input: LevenshtainVector = self.get_vector(VectorName(in_name))
+        with self.__change():
+            # состояния и вектор, созданные в пакете, известны без запросов
+            tx = self.__transaction
+            ids = [to_state] if from_state is None else [from_state, to_state]
+            tx.states.update(
+                self.states([id for id in ids if id not in tx.states]),
+            )
+            for id in ids:
+                if id not in tx.states:
+                    raise NotExists(id, f'Нет состояния с id "{id.value}"')
+
+            state_from = None if from_state is None else tx.states[from_state]
+            state_to = tx.states[to_state]
+            input: LevenshtainVector = self.get_vector(input_name)
+
+            # переход вставляется при завершении пакета
+            if from_state is None:
+                tx.enters.add(to_state)
+            self.__defer(
+                _INSERT_STEP,
+                [
+                    (
+                        self.id.value,
+                        None if from_state is None else from_state.value,
+                        to_state.value,
+                        input_name.value,
+                    ),
+                ],
+            )
 
-        return Step(
-            input,
-            Connection(state_from, state_to, None)#, input.synonyms.synonyms), # wtf?
-        )
+            return Step(
+                input,
+                Connection(state_from, state_to, None)#, input.synonyms.synonyms), # wtf?
+            )
 
     def delete_step(
         self,
@@ -560,108 +667,79 @@ class SourceMySQL(Source):
         to_state: StateID | None,
         input_name: VectorName = None,
     ):
-        if from_state is None:
-            self.__do(
-                f"DELETE FROM `steps` WHERE `project_id` = {self.id.value}"
-                f" AND `from_state_id` IS NULL"
-                f" AND `to_state_id` = {to_state.value}",
-            )
-        else:
-            self.__do(
-                f"DELETE FROM `steps` WHERE `project_id` = {self.id.value}"
-                f" AND `from_state_id` = {from_state.value}"
-                f" AND `vector_name` = '{input_name.value}'",
-            )
+        with self.__change():
+            if from_state is None:
+                self.__do(
+                    f"DELETE FROM `steps` WHERE `project_id` = {self.id.value}"
+                    f" AND `from_state_id` IS NULL"
+                    f" AND `to_state_id` = {to_state.value}",
+                )
+            else:
+                self.__do(
+                    f"DELETE FROM `steps` WHERE `project_id` = {self.id.value}"
+                    f" AND `from_state_id` = {from_state.value}"
+                    f" AND `vector_name` = '{input_name.value}'",
+                )
 
     def get_all_connections(self) -> dict[str, dict]:
-        conn: pymysql.Connection = self.__db_connection
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT `from_state_id`, `to_state_id`, `vector_name` FROM `steps` WHERE `project_id` = %s AND `from_state_id` IS NULL",
+        db_result = self.__query(
+            "SELECT `from_state_id`, `to_state_id`, `vector_name` FROM `steps` WHERE `project_id` = %s",
             (self.id.value,),
         )
-        conn.commit()
-        db_result_to = cur.fetchall()
-
-        cur.execute(
-            "SELECT `from_state_id`, `to_state_id`, `vector_name` FROM `steps` WHERE `project_id` = %s AND NOT `from_state_id` IS NULL",
-            (self.id.value,),
-        )
-        conn.commit()
-        db_result_from = cur.fetchall()
+        f_states = self.states()
+        f_vectors = self.__load_vectors()
 
         result = {
             "from": dict[StateID, list[Connection]](),
             "to": dict[StateID, Connection](),
         }
+        conns = dict[tuple[StateID | None, StateID], Connection]()
 
-        f_states = self.states()
-        # сформировать все Connection
-        for _from_state, _to_state, _vector_name in db_result_from:
-            # raise not _from_state is None
-            __to_state_id = StateID(_to_state)
-            __to_state = f_states[__to_state_id]
-
-            __from_state_id = StateID(_from_state)
-            __from_state = f_states[__from_state_id]
-
-            if __from_state_id in result["from"].keys():
-                __conn_list = result["from"][__from_state_id]
-            else:
-                __conn_list = list[Connection]()
-                result["from"][__from_state_id] = __conn_list
-
-            skip_append = False
-            for _conn in __conn_list:
-                if _conn.to_state == __to_state:
-                    skip_append = True
-                    break
-
-            if skip_append:
-                continue
-            __conn_list.append(Connection(__from_state, __to_state, []))
-
-        for _from_state, _to_state, _vector_name in db_result_to:
+        # сформировать все Connection и заполнить их переходами за один проход
+        for _from_state, _to_state, _vector_name in db_result:
             __to_state_id = StateID(_to_state)
-            if __to_state_id in result["to"].keys():
-                continue
-
-            result["to"][__to_state_id] = Connection(
-                None,
-                f_states[__to_state_id],
-                [],
+            __from_state_id = (
+                None if _from_state is None else StateID(_from_state)
             )
 
-        f_vectors = self.select_vectors()
+            _conn = conns.get((__from_state_id, __to_state_id))
+            if _conn is None:
+                if __from_state_id is None:
+                    _conn = Connection(None, f_states[__to_state_id], [])
+                    result["to"][__to_state_id] = _conn
+                else:
+                    _conn = Connection(
+                        f_states[__from_state_id],
+                        f_states[__to_state_id],
+                        [],
+                    )
+                    result["from"].setdefault(__from_state_id, []).append(
+                        _conn,
+                    )
+
+                conns[(__from_state_id, __to_state_id)] = _conn
+
+            step = Step(f_vectors[VectorName(_vector_name)], _conn)
+            _conn.steps.append(step)  # вроде должны быть уникальными
 
-        # заполнить все Connection переходами
-        _conn: Connection | None = None
-        for _from_state, _to_state, _vector_name in db_result_from:
-            __from_state_id = StateID(_from_state)
-            __to_state_id = StateID(_to_state)
-            # raise not _from_state is None
-            for __conn in result["from"][__from_state_id]:
-                if __conn.to_state.id() == __to_state_id:
-                    _conn = __conn
-                    break
+        return result
 
-            step = Step(
-                self.__find_vector(f_vectors, VectorName(_vector_name)),
-                _conn,
-            )
-            _conn.steps.append(step)  # вроде должны быть уникальными
+    def get_step_links(
+        self,
+    ) -> list[tuple[StateID | None, StateID, VectorName]]:
+        db_result = self.__query(
+            "SELECT `from_state_id`, `to_state_id`, `vector_name` FROM `steps` WHERE `project_id` = %s",
+            (self.id.value,),
+        )
 
-        for _from_state, _to_state, _vector_name in db_result_to:
-            __from_state_id = None  # always is None
-            __to_state_id = StateID(_to_state)
-            _conn = result["to"][__to_state_id]
-            step = Step(
-                self.__find_vector(f_vectors, VectorName(_vector_name)),
-                _conn,
+        return [
+            (
+                None if _from_state is None else StateID(_from_state),
+                StateID(_to_state),
+                VectorName(_vector_name),
             )
-            _conn.steps.append(step)  # вроде должны быть уникальными
-
-        return result
+            for _from_state, _to_state, _vector_name in db_result
+        ]
 
 #    def set_synonym_value(
 #        self,
@@ -687,76 +765,312 @@ class SourceMySQL(Source):
 #        )
 
     def rename_state(self, state: StateID, name: StateName):
-        self.__do(
-            "UPDATE `states` SET `name`= %s WHERE `project_id`= %s AND `id`= %s",
-            (name.value, self.id.value, state.value),
-        )
+        with self.__change():
+            self.__do(
+                "UPDATE `states` SET `name`= %s WHERE `project_id`= %s AND `id`= %s",
+                (name.value, self.id.value, state.value),
+            )
 
     def rename_vector(self, old_name: VectorName, new_name: VectorName):
-        self.__do(
-            "UPDATE `vectors` SET `name`= %s WHERE `project_id`= %s AND `name`= %s",
-            (new_name.value, self.id.value, old_name.value),
+        with self.__change():
+            self.__do(
+                "UPDATE `vectors` SET `name`= %s WHERE `project_id`= %s AND `name`= %s",
+                (new_name.value, self.id.value, old_name.value),
+            )
+
+
+_INSERT_CHUNK = 1000
+""" наибольшее число строк в одном многострочном INSERT """
+
+
+class _ScenarioImport:
+    """
+    Запись сценария, поступающего по частям: строки копятся по таблицам
+    и записываются многострочными запросами по _INSERT_CHUNK строк
+    """
+
+    __cursor: Any
+    __project_id: int
+
+    __vectors: list[tuple]
+    __synonyms: list[tuple]
+    __states: list[State]
+
+    __steps: list[tuple]
+    """ строки переходов, состояния которых уже записаны """
+
+    __waiting: dict[StateID, list[tuple[StateID | None, StateID, str | None]]]
+    """
+    переходы с исходными id состояний, ожидающие запись состояния
+    (по id недостающего состояния; None вместо вектора - вход)
+    """
+
+    __names: dict[StateID, str]
+    """ имена состояний (команда входа - вектор с именем состояния) """
+
+    id_map: dict[StateID, StateID]
+    """ соответствие исходных id состояний новым """
+
+    def __init__(self, cursor: Any, project_id: int) -> None:
+        self.__cursor = cursor
+        self.__project_id = project_id
+        self.__vectors = []
+        self.__synonyms = []
+        self.__states = []
+        self.__steps = []
+        self.__waiting = {}
+        self.__names = {}
+        self.id_map = {}
+
+    def add(self, item: ScenarioItem):
+        if isinstance(item, InputDescription):
+            _name = item.name().value
+            self.__vectors.append((self.__project_id, _name, "synonyms_set"))
+            for index in range(len(item)):
+                self.__synonyms.append(
+                    (self.__project_id, _name, item.value(index).value()),
+                )
+            if (
+                len(self.__vectors) >= _INSERT_CHUNK
+                or len(self.__synonyms) >= _INSERT_CHUNK
+            ):
+                self.__write_vectors()
+
+        elif isinstance(item, State):
+            self.__names[item.id()] = item.attributes.name.value
+            self.__states.append(item)
+            if len(self.__states) >= _INSERT_CHUNK:
+                self.__write_states()
+
+        elif isinstance(item, StateID):
+            self.__add_step((None, item, None))
+
+        else:
+            from_state, to_state, vector_name = item
+            self.__add_step((from_state, to_state, vector_name.value))
+
+        if len(self.__steps) >= _INSERT_CHUNK:
+            self.__write_steps()
+
+    def finish(self):
+        """
+        Записать оставшиеся строки.
+        Переход на состояние, которого нет в сценарии, - ошибка:
+        транзакция импорта откатывается
+        """
+        self.__write_vectors()
+        self.__write_states()
+        self.__write_steps()
+
+        if self.__waiting:
+            state_id = next(iter(self.__waiting.keys()))
+            raise NotExists(state_id, f'Состояние с id "{state_id.value}"')
+
+    def __add_step(self, step: tuple[StateID | None, StateID, str | None]):
+        from_state, to_state, vector_name = step
+        for state_id in (to_state, from_state):
+            if state_id is not None and state_id not in self.id_map:
+                # состояние ещё не записано (или в файле оно дальше)
+                self.__waiting.setdefault(state_id, []).append(step)
+                return
+
+        self.__steps.append(
+            (
+                self.__project_id,
+                None if from_state is None else self.id_map[from_state].value,
+                self.id_map[to_state].value,
+                self.__names[to_state] if vector_name is None else vector_name,
+            ),
         )
 
+    def __write_vectors(self):
+        if self.__vectors:
+            self.__cursor.executemany(
+                "INSERT INTO `vectors` (`project_id`, `name`, `type`) VALUES (%s, %s, %s)",
+                self.__vectors,
+            )
+            self.__vectors.clear()
+
+        if self.__synonyms:
+            self.__cursor.executemany(
+                "INSERT INTO `synonyms` (`project_id`, `group_name`, `value`) VALUES (%s, %s, %s)",
+                self.__synonyms,
+            )
+            self.__synonyms.clear()
+
+    def __write_states(self):
+        if not self.__states:
+            return
+
+        data = []
+        for state in self.__states:
+            data.extend(
+                (
+                    self.__project_id,
+                    state.attributes.name.value,
+                    state.attributes.description.value,
+                    state.output().value().as_text(),
+                    state.required,
+                ),
+            )
+
+        # новые id состояний возвращаются в порядке строк INSERT
+        self.__cursor.execute(
+            "INSERT INTO `states` (`project_id`, `name`, `descr`, `answer`, `required`) VALUES "
+            + ", ".join(["(%s, %s, %s, %s, %s)"] * len(self.__states))
+            + " RETURNING `id`",
+            data,
+        )
+        for state, (new_id,) in zip(self.__states, self.__cursor.fetchall()):
+            self.id_map[state.id()] = StateID(new_id)
+
+        # переходы, ожидавшие записанные состояния
+        for state in self.__states:
+            for step in self.__waiting.pop(state.id(), ()):
+                self.__add_step(step)
+
+        self.__states.clear()
+
+    def __write_steps(self):
+        # переходы ссылаются на вектора
+        self.__write_vectors()
+
+        if self.__steps:
+            self.__cursor.executemany(
+                "INSERT INTO `steps` (`project_id`, `from_state_id`, `to_state_id`, `vector_name`) VALUES (%s, %s, %s, %s)",
+                self.__steps,
+            )
+            self.__steps.clear()
+
 
 class HostingMySQL(Hosting):
-    __connection: pymysql.Connection | None
+    __pool: ConnectionPool | None
 
     def __init__(self) -> None:
-        self.__connection = None
+        self.__pool = None
 
     def connected(self) -> bool:
-        if not isinstance(self.__connection, pymysql.Connection):
-            return False
+        return self.__pool is not None
+
+    def connect(
+        self,
+        ip: str,
+        port: int,
+        username: str,
+        password: str,
+        min_size: int = 1,
+        max_size: int = 8,
+    ):
+        """
+        Открыть пул подключений к БД
+        @min_size - число постоянно открытых подключений
+        @max_size - наибольшее число одновременно используемых подключений
+        """
+        if self.connected():
+            return
+
+        def connect() -> pymysql.Connection:
+            return pymysql.connect(
+                host=ip,
+                port=port,
+                user=username,
+                password=password,
+                database="ii_constructor",
+            )
 
-        return self.__connection.open
+        self.__pool = ConnectionPool(connect, min_size, max_size)
 
-    def connect(self, ip: str, port: int, username: str, password: str):
-        if not self.connected():
-            try:
-                self.__connection = pymysql.connect(
-                    host=ip,
-                    port=port,
-                    user=username,
-                    password=password,
-                    database="ii_constructor",
-                )
-                self.__connection.auto_reconnect = True
-            except pymysql.Error:
-                self.__connection = None
-                raise
+    def disconnect(self):
+        """Закрыть пул подключений"""
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool = None
 
-    def get_scenario(self, id: ScenarioID) -> ScenarioInterface:
+    def pool(self) -> ConnectionPool:
         if not self.connected():
             raise CoreException("БД не подключена")
 
-        return Scenario(SourceMySQL(self.__connection, id))
+        return self.__pool
 
-    def add_source(self, info: SourceInfo) -> ScenarioID:
-        if not self.connected():
-            raise CoreException("БД не подключена")
+    def get_scenario(self, id: ScenarioID) -> ScenarioInterface:
+        return Scenario(SourceMySQL(self.pool(), id))
+
+    def version(self, id: ScenarioID) -> int:
+        """
+        Версия сценария (увеличивается при каждом изменении).
+        Один запрос по первичному ключу: подходит для частого опроса
+        """
+        with self.pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT `version` FROM `projects` WHERE `id` = %s",
+                (id.value,),
+            )
+            rows = cursor.fetchall()
+            conn.commit()
 
-        conn: pymysql.Connection = self.__connection
-        cursor = conn.cursor()
+        if not rows:
+            raise NotExists(id, f'Сценарий с id "{id.value}"')
+
+        return rows[0][0]
+
+    def add_source(self, info: SourceInfo) -> ScenarioID:
+        with self.pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO `projects` (`name`, `description`) VALUES (%s, %s) RETURNING `id`",
+                (info.name.value, info.description.value),
+            )
+            conn.commit()
+            (result,) = cursor.fetchone()
 
-        cursor.execute(
-            "INSERT INTO `projects` (`name`, `description`) VALUES (%s, %s) RETURNING `id`",
-            (info.name.value, info.description.value),
-        )
-        conn.commit()
-        (result,) = cursor.fetchone()
         return ScenarioID(result)
 
+    def import_scenario(
+        self,
+        items: ScenarioDump | Iterable[ScenarioItem],
+    ) -> tuple[ScenarioID, dict[StateID, StateID]]:
+        """
+        Загрузить сценарий одной транзакцией.
+        Элементы сценария (первым - сведения о проекте) проверяются
+        и записываются частями по мере поступления, поэтому сценарий,
+        читаемый из файла, целиком в памяти не хранится. При ошибке
+        в элементах транзакция откатывается
+        Возвращает id нового сценария и соответствие исходных id состояний новым
+        """
+        if isinstance(items, ScenarioDump):
+            items = items.items()
+
+        items = validated_items(items)
+        info: SourceInfo = next(items)
+
+        with self.pool().connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                "INSERT INTO `projects` (`name`, `description`) VALUES (%s, %s) RETURNING `id`",
+                (info.name.value, info.description.value),
+            )
+            (project_id,) = cursor.fetchone()
+
+            writer = _ScenarioImport(cursor, project_id)
+            for item in items:
+                writer.add(item)
+            writer.finish()
+
+            conn.commit()
+
+        return ScenarioID(project_id), writer.id_map
+
     def sources(self) -> list[tuple[int, str, str]]:
         result = list[tuple[int, str, str]]()
 
-        conn: pymysql.Connection = self.__connection
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT `id`, `name`, `description` FROM `projects`")
-        conn.commit()
+        with self.pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT `id`, `name`, `description` FROM `projects`")
+            conn.commit()
 
-        for row in cursor:
-            result.append(row)
+            for row in cursor:
+                result.append(row)
 
         return result
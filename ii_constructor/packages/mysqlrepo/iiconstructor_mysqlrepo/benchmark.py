@@ -0,0 +1,135 @@
+# Copyright 2024 Николай Иванцов (tg/vk/wa: <@mikolainer> | <mikolainer@mail.ru>)
+# Copyright 2024 Kirill Lesovoy
+#
+# Этот файл — часть "Конструктора интерактивных инструкций".
+#
+# Конструктор интерактивных инструкций — свободная программа:
+# вы можете перераспространять ее и/или изменять ее на условиях
+# Стандартной общественной лицензии GNU в том виде,
+# в каком она была опубликована Фондом свободного программного обеспечения;
+# либо версии 3 лицензии, либо (по вашему выбору) любой более поздней версии.
+# Конструктор интерактивных инструкций распространяется в надежде,
+# что она будет полезной, но БЕЗО ВСЯКИХ ГАРАНТИЙ;
+# даже без неявной гарантии ТОВАРНОГО ВИДА
+# или ПРИГОДНОСТИ ДЛЯ ОПРЕДЕЛЕННЫХ ЦЕЛЕЙ.
+# Подробнее см. в Стандартной общественной лицензии GNU.
+#
+# Вы должны были получить копию Стандартной общественной лицензии GNU
+# вместе с этой программой. Если это не так,
+# см. <https://www.gnu.org/licenses/>.
+
+
+"""
+Замер времени SourceMySQL.steps() для состояния с большим числом переходов.
+Создаёт в БД временный проект, замеряет и удаляет его.
+Параметры подключения - из переменных окружения IP, PORT, USER, PASSWORD.
+
+python -m iiconstructor_mysqlrepo.benchmark --steps 500 --repeat 50
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import time
+
+from iiconstructor_answers.plaintext import (
+    PlainTextAnswer,
+    PlainTextDescription,
+)
+from iiconstructor_core.domain import Source, State
+from iiconstructor_core.domain.primitives import (
+    Description,
+    ProjectName,
+    SourceInfo,
+    StateAttributes,
+    StateName,
+)
+from iiconstructor_inputvectors.domain import VectorName
+from iiconstructor_levenshtain import LevenshtainVector, Synonym
+
+from . import HostingMySQL
+
+logger = logging.getLogger(__name__)
+
+
+def fill(src: Source, steps: int, synonyms: int) -> State:
+    """Проект: состояние-узел с steps исходящими и steps входящими переходами"""
+    hub = src.create_state(
+        StateAttributes(StateName("узел"), Description("")),
+        PlainTextDescription(PlainTextAnswer("ответ")),
+    )
+    for i in range(steps):
+        name = VectorName(f"вектор {i}")
+        src.add_vector(
+            LevenshtainVector(
+                name,
+                [Synonym(f"синоним {i} {j}") for j in range(synonyms)],
+            ),
+        )
+        state = src.create_state(
+            StateAttributes(StateName(f"состояние {i}"), Description("")),
+            PlainTextDescription(PlainTextAnswer("ответ")),
+        )
+        src.new_step(hub.id(), state.id(), name)
+        src.new_step(state.id(), hub.id(), name)
+
+    return hub
+
+
+def drop(hosting: HostingMySQL, project_id: int):
+    with hosting.pool().connection() as conn:
+        cur = conn.cursor()
+        for table in ("steps", "synonyms", "vectors", "states"):
+            cur.execute(
+                f"DELETE FROM `{table}` WHERE `project_id` = %s",
+                (project_id,),
+            )
+        cur.execute("DELETE FROM `projects` WHERE `id` = %s", (project_id,))
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--synonyms", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    hosting = HostingMySQL()
+    hosting.connect(
+        os.environ.get("IP"),
+        int(os.environ.get("PORT")),
+        os.environ.get("USER"),
+        os.environ.get("PASSWORD"),
+    )
+
+    src = hosting.get_scenario(
+        hosting.add_source(
+            SourceInfo(ProjectName("benchmark"), Description("")),
+        ),
+    ).source()
+    # временный проект удаляется и при ошибке заполнения
+    try:
+        hub = fill(src, args.steps, args.synonyms)
+        timings = list[float]()
+        for _ in range(args.repeat):
+            begin = time.perf_counter()
+            result = src.steps(hub.id())
+            timings.append((time.perf_counter() - begin) * 1000)
+
+        timings.sort()
+        logger.info("переходов: %d, замеров: %d", len(result), len(timings))
+        logger.info(
+            "steps(), мс: среднее %.2f, медиана %.2f, p95 %.2f",
+            statistics.mean(timings),
+            statistics.median(timings),
+            timings[int(len(timings) * 0.95) - 1],
+        )
+    finally:
+        drop(hosting, src.id.value)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main()
@@ -3,12 +3,18 @@ mkdir .\engine
 ::mkdir .\engine\iiconstructor_core\domain
 
 xcopy .\ii_constructor\packages\core\iiconstructor_core\ .\engine\iiconstructor_core\ /E
+xcopy .\ii_constructor\packages\inmemoryrepo\iiconstructor_inmemory\ .\engine\iiconstructor_inmemory\ /E
+xcopy .\ii_constructor\packages\levenshtain\iiconstructor_levenshtain\ .\engine\iiconstructor_levenshtain\ /E
 
 echo pymysql > ./engine/requirements.txt
-echo Levenshtein >> ./engine/requirements.txt
+echo rapidfuzz >> ./engine/requirements.txt
 
 copy .\ii_constructor\apps\engine\index.py .\engine\index.py
+copy .\ii_constructor\apps\engine\alice.py .\engine\alice.py
+copy .\ii_constructor\apps\engine\server.py .\engine\server.py
+copy .\ii_constructor\apps\engine\host.py .\engine\host.py
+copy .\ii_constructor\apps\engine\workers.py .\engine\workers.py
+copy .\ii_constructor\apps\engine\__main__.py .\engine\__main__.py
 copy .\ii_constructor\packages\mysqlrepo\iiconstructor_mysqlrepo\__ini__.py .\engine\mysqlrepo.py
-copy .\ii_constructor\packages\levenshtain\iiconstructor_levenshtain\__init__.py .\engine\iiconstructor_levenshtain.py
 
 pause